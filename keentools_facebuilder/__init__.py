@@ -158,6 +158,7 @@ else:
     from .actor import FB_OT_Actor, FB_OT_CameraActor
 
     from .utils.icons import FBIcons
+    from .utils.meshes import FBMeshGeomUpdater
 
     CLASSES_TO_REGISTER = (MESH_OT_FBAddHead,
                            MESH_OT_FBAddBody,
@@ -206,6 +207,9 @@ else:
         FBIcons.register()
         logger.debug("ICONS REGISTERED")
 
+        FBMeshGeomUpdater.register_handlers()
+        logger.debug("APP HANDLERS REGISTERED")
+
 
     def unregister():
         logger = logging.getLogger(__name__)
@@ -221,6 +225,9 @@ else:
         FBIcons.unregister()
         logger.debug("ICONS UNREGISTERED")
 
+        FBMeshGeomUpdater.unregister_handlers()
+        logger.debug("APP HANDLERS UNREGISTERED")
+
 
 if __name__ == "__main__":
     register()
@@ -48,6 +48,16 @@ class Config:
     default_fb_collection_name = 'FaceBuilderCol'
     default_fb_camera_data_name = 'fbCamData'
     default_fb_camera_name = 'fbCamera'
+    # Leading dot hides template meshes from Blender data lists
+    template_mesh_prefix = '.' + prefix + '_template'
+    # Builder UV sets stored as named UV layers of head mesh
+    uv_sets = (('uv0', 'Butterfly'), ('uv1', 'Legacy'),
+               ('uv2', 'Spherical'), ('uv3', 'Maxface'))
+    # Memory limit for cached per-keyframe head vertices
+    expression_cache_max_bytes = 64 * 1024 * 1024
+    neutral_shape_key_name = 'Basis'
+    expression_shape_key_prefix = 'FBView'
+    expressions_object_suffix = '_expressions'
 
     addon_search = 'KeenTools'
     addon_global_var_name = prefix + '_settings'
@@ -118,6 +128,10 @@ class Config:
     fb_reset_expression_callname = 'reset_expression'
     fb_reset_expression_idname = operators + '.' + fb_reset_expression_callname
 
+    fb_export_expressions_callname = 'export_expressions'
+    fb_export_expressions_idname = \
+        operators + '.' + fb_export_expressions_callname
+
     fb_bake_tex_callname = 'bake_tex'
     fb_bake_tex_idname = operators + '.' + fb_bake_tex_callname
 
@@ -152,6 +166,10 @@ class Config:
     fb_texture_file_export_idname = \
         operators + '.' + fb_texture_file_export_callname
 
+    fb_head_file_export_callname = 'head_file_export'
+    fb_head_file_export_idname = \
+        operators + '.' + fb_head_file_export_callname
+
     fb_pinmode_callname = 'pinmode'
     fb_pinmode_idname = operators + '.' + fb_pinmode_callname
 
@@ -272,6 +290,9 @@ class Config:
     fb_dir_prop_name = (prefix + '_dir',)
     fb_camera_prop_name = (prefix + '_camera',)
     fb_mod_ver_prop_name = (prefix + '_mod_ver',)
+    template_signature_prop_name = (prefix + '_template_signature',)
+    # Mesh auto smooth state before exact normals were applied
+    exact_normals_prop_name = (prefix + '_exact_normals',)
     # Save / Reconstruct parameters
     reconstruct_focal_param = ('focal',)
     reconstruct_sensor_width_param = ('sensor_width',)
@@ -286,6 +307,8 @@ class Config:
     text_scale_y = 0.75
 
     viewport_redraw_interval = 0.1
+    camera_border_cache_size = 16
+    rigid_tolerance = 1e-6
     unknown_mod_ver = -1
 
     default_sensor_width = 36.0
@@ -331,6 +354,9 @@ class Config:
 
     pin_color = (1.0, 0.0, 0.0, 1.0)
     current_pin_color = (1.0, 0.0, 1.0, 1.0)
+    hover_pin_color = (1.0, 1.0, 0.0, 1.0)
+    selected_pin_color = (1.0, 0.5, 0.0, 1.0)
+    selection_box_color = (1.0, 1.0, 1.0, 0.6)
     surface_point_color = (0.0, 1.0, 1.0, 0.5)
     residual_color = (0.0, 1.0, 1.0, 0.5)
 
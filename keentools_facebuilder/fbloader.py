@@ -23,7 +23,10 @@ import math
 import numpy as np
 
 from .viewport import FBViewport
-from .utils import attrs, coords, cameras
+from .utils import attrs, coords, cameras, meshes
+from .utils.expressions import FBExpressionCache
+from .utils.pincache import FBPinCache
+from .utils.projected import FBProjectedVertices
 from .utils.other import FBStopShaderTimer, restore_ui_elements
 from .utils.exif_reader import update_image_groups, reload_all_camera_exif
 
@@ -37,6 +40,8 @@ class FBLoader:
     # Builder selection: FaceBuilder or BodyBuilder
     builder_instance = None
     _viewport = FBViewport()
+    # Changed on every solve or builder state change
+    _solve_version = 0
 
     @classmethod
     def viewport(cls):
@@ -66,8 +71,79 @@ class FBLoader:
     @classmethod
     def new_builder(cls, builder_type=BuilderType.NoneBuilder,
                     ver=Config.unknown_mod_ver):
+        cls.builder_state_changed()
         return cls.builder().new_builder(builder_type, ver)
 
+    @classmethod
+    def solve_version(cls):
+        return cls._solve_version
+
+    @classmethod
+    def builder_state_changed(cls):
+        cls._solve_version += 1
+        FBExpressionCache.invalidate()
+        FBPinCache.invalidate()
+        FBProjectedVertices.invalidate()
+
+    @classmethod
+    def builder_deserialized(cls, serial_str):
+        """ Caches survive deserialization of the same builder state """
+        cls._solve_version += 1
+        FBExpressionCache.on_deserialize(serial_str)
+        FBPinCache.on_deserialize(serial_str)
+        FBProjectedVertices.on_deserialize(serial_str)
+
+    @classmethod
+    def builder_keyframe_changed(cls, kid):
+        FBExpressionCache.invalidate_keyframe(kid)
+        FBPinCache.invalidate(kid)
+        FBProjectedVertices.invalidate()
+
+    @classmethod
+    def builder_pins_changed(cls, kid=None):
+        FBPinCache.invalidate(kid)
+
+    # --------------------
+    # Builder pins changes
+    # --------------------
+    @classmethod
+    def add_pin(cls, kid, pos):
+        pin = cls.get_builder().add_pin(kid, pos)
+        if pin is not None:
+            cls.builder_pins_changed(kid)
+        return pin
+
+    @classmethod
+    def move_pin(cls, kid, pin_idx, pos):
+        cls.get_builder().move_pin(kid, pin_idx, pos)
+        cls.builder_pins_changed(kid)
+
+    @classmethod
+    def move_pins(cls, kid, indices, positions):
+        """ Many pins move with one pin cache reset """
+        fb = cls.get_builder()
+        for i, pos in zip(indices, positions):
+            fb.move_pin(kid, int(i), tuple(pos))
+        cls.builder_pins_changed(kid)
+
+    @classmethod
+    def remove_pin(cls, kid, pin_idx):
+        cls.get_builder().remove_pin(kid, pin_idx)
+        cls.builder_pins_changed(kid)
+
+    @classmethod
+    def remove_pins(cls, kid):
+        cls.get_builder().remove_pins(kid)
+        cls.builder_pins_changed(kid)
+
+    @classmethod
+    def deserialize(cls, serial_str):
+        if not cls.get_builder().deserialize(serial_str):
+            cls.builder_state_changed()
+            return False
+        cls.builder_deserialized(serial_str)
+        return True
+
     @classmethod
     def get_builder_type(cls):
         return cls.builder().get_builder_type()
@@ -177,7 +253,6 @@ class FBLoader:
     @classmethod
     def shader_update(cls, headobj):
         cls.viewport().wireframer().init_geom_data(headobj)
-        cls.viewport().wireframer().init_edge_indices(headobj)
         cls.viewport().wireframer().create_batches()
 
     @classmethod
@@ -191,9 +266,10 @@ class FBLoader:
         kid = settings.get_keyframe(headnum, camnum)
         cls.place_cameraobj(kid, camobj, headobj)
         coords.update_head_mesh(settings, fb, head)
+        cls.update_exact_normals(head)
         # Load pins from model
         vp = cls.viewport()
-        vp.pins().set_pins(vp.img_points(fb, kid))
+        vp.pins().set_pins(vp.img_points(fb, kid), kid)
         vp.update_surface_points(fb, headobj, kid)
 
         cls.shader_update(headobj)
@@ -222,11 +298,17 @@ class FBLoader:
         head = settings.get_head(headnum)
         headobj = head.headobj
 
-        for i, cam in enumerate(head.cameras):
-            if cam.has_pins():
-                kid = cam.get_keyframe()
-                cls.place_cameraobj(kid, cam.camobj, headobj)
-                cam.set_model_mat(fb.model_mat(kid))
+        pinned_cams = [cam for cam in head.cameras if cam.has_pins()]
+        if len(pinned_cams) == 0:
+            return
+        model_mats = np.array([fb.model_mat(cam.get_keyframe())
+                               for cam in pinned_cams])
+        mats, valid = coords.calc_model_mats(model_mats, headobj.matrix_world)
+        for cam, model_mat, mat, ok in zip(pinned_cams, model_mats,
+                                           mats, valid):
+            if ok:
+                cam.camobj.matrix_world = mat
+            cam.set_model_mat(model_mat)
 
     @classmethod
     def update_all_camera_focals(cls, headnum):
@@ -263,6 +345,7 @@ class FBLoader:
             return
         fb = FBLoader.get_builder()
         projection = camera.get_projection_matrix()
+        cls.builder_keyframe_changed(camera.get_keyframe())
         fb.set_centered_geo_keyframe(camera.get_keyframe(), projection,
                                      camera.get_oriented_image_size())
 
@@ -295,6 +378,7 @@ class FBLoader:
 
         fb = cls.get_builder()
         fb.set_projection_mat(projection)
+        FBProjectedVertices.invalidate()
 
     @classmethod
     def update_pins_count(cls, headnum, camnum):
@@ -304,7 +388,7 @@ class FBLoader:
         cam = head.get_camera(camnum)
         fb = cls.get_builder()
         kid = settings.get_keyframe(headnum, camnum)
-        pins_count = fb.pins_count(kid)
+        pins_count = FBPinCache.pins_count(fb, kid)
         cam.pins_count = pins_count
         logger.debug("PINS_COUNT H:{} C:{} k:{} count:{}".format(
             headnum, camnum, kid, pins_count))
@@ -318,11 +402,7 @@ class FBLoader:
         return 1
 
     @classmethod
-    def get_builder_mesh(cls, builder, mesh_name='keentools_mesh',
-                         masks=(), uv_set='uv0', keyframe=None):
-        for i, m in enumerate(masks):
-            builder.set_mask(i, m)
-
+    def _select_builder_uv_set(cls, builder, uv_set):
         # change UV in accordance to selected UV set
         # Blender can't use integer as key in enum property
         builder.select_uv_set(0)
@@ -333,82 +413,310 @@ class FBLoader:
         if uv_set == 'uv3':
             builder.select_uv_set(3)
 
+    @classmethod
+    def _get_model_mesh(cls, builder, keyframe=None):
         if keyframe is not None:
             geo = builder.applied_args_model_at(keyframe)
         else:
             geo = builder.applied_args_model()
-        me = geo.mesh(0)
-
-        v_count = me.points_count()
-        vertices = []
-        for i in range(0, v_count):
-            vertices.append(me.point(i))
-
-        rot = np.array([[1., 0., 0.], [0., 0., 1.], [0., -1., 0]])
-        vertices2 = vertices @ rot
-        # vertices2 = vertices
-
-        f_count = me.faces_count()
-        faces = []
-
-        # Normals are not in use yet
-        normals = []
-        n = 0
-        for i in range(0, f_count):
-            row = []
-            for j in range(0, me.face_size(i)):
-                row.append(me.face_point(i, j))
-                normal = me.normal(i, j) @ rot
-                normals.append(tuple(normal))
-                n += 1
-            faces.append(tuple(row))
+        return geo.mesh(0)
 
-        mesh = bpy.data.meshes.new(mesh_name)
-        mesh.from_pydata(vertices2, [], faces)
+    @classmethod
+    def _extract_topology(cls, builder, keyframe=None):
+        me = cls._get_model_mesh(builder, keyframe)
+        face_sizes, face_indices = meshes.get_mesh_faces(me)
+        return face_sizes, face_indices, meshes.get_mesh_uvs(me)
 
-        # Init Custom Normals (work on Shading Flat!)
-        # mesh.calc_normals_split()
-        # mesh.normals_split_custom_set(normals)
+    @classmethod
+    def _get_part_faces(cls, builder, key, part, parts_count, full):
+        removed = meshes.FBMeshTopologyCache.get_part_faces(key, part)
+        if removed is not None:
+            return removed
+        for i in range(parts_count):
+            builder.set_mask(i, i != part)
+        face_sizes, face_indices, _ = cls._extract_topology(builder)
+        return meshes.FBMeshTopologyCache.put_part_faces(
+            key, part, meshes.missing_faces(full[0], full[1],
+                                            face_sizes, face_indices))
 
-        # Simple Shade Smooth analog
-        values = [True] * len(mesh.polygons)
-        mesh.polygons.foreach_set('use_smooth', values)
+    @classmethod
+    def _model_version(cls, builder_type, builder_version):
+        """ Head mod_ver is expected, UniBuilder version label is used
+        if it is None. Unknown version is the latest model """
+        if builder_version is None:
+            builder_version = cls.get_builder_version()
+        if builder_version == Config.unknown_mod_ver and \
+                builder_type == BuilderType.FaceBuilder:
+            return pkt.module().FaceBuilder.latest_face_version()
+        return builder_version
 
-        uvtex = mesh.uv_layers.new()
-        uvmap = uvtex.data
-        # Fill uvs in uvmap
-        uvs_count = me.uvs_count()
-        for i in range(uvs_count):
-            uvmap[i].uv = me.uv(i)
+    @classmethod
+    def _checked_topology(cls, builder, points_count, masks, uv_set,
+                          keyframe, builder_type, builder_version):
+        """ get_builder_topology which faces may not refer to missing
+        model vertices. Vertex count is the one caller has already got,
+        so no model is built for the check """
+        topology = cls.get_builder_topology(builder, masks, uv_set, keyframe,
+                                            builder_type, builder_version)
+        face_indices = topology[1]
+        if len(face_indices) == 0 or face_indices.max() < points_count:
+            return topology
+        if builder_type is None:
+            builder_type = cls.get_builder_type()
+        logger = logging.getLogger(__name__)
+        logger.warning("TOPOLOGY CACHE MISMATCH: {} {}".format(
+            builder_type, builder_version))
+        meshes.FBMeshTopologyCache.invalidate(builder_type)
+        return cls.get_builder_topology(builder, masks, uv_set, keyframe,
+                                        builder_type, builder_version)
 
-        mesh.update()
+    @classmethod
+    def get_builder_topology(cls, builder, masks=(), uv_set='uv0',
+                             keyframe=None, builder_type=None,
+                             builder_version=None):
+        """ Cached (face_sizes, face_indices, uvs) of builder mesh.
+        Masked topology is derived from the full one, so every mask part
+        is requested from the builder only once per session """
+        if builder_type is None:
+            builder_type = cls.get_builder_type()
+        builder_version = cls._model_version(builder_type, builder_version)
+        key = meshes.FBMeshTopologyCache.make_key(
+            builder_type, builder_version, masks, uv_set)
+        topology = meshes.FBMeshTopologyCache.get(key)
+        if topology is not None:
+            return topology
+
+        if all(masks):
+            faces = meshes.FBMeshTopologyCache.find_faces(key)
+            if faces is None:
+                return meshes.FBMeshTopologyCache.put(
+                    key, *cls._extract_topology(builder, keyframe))
+            return meshes.FBMeshTopologyCache.put(
+                key, *faces, meshes.get_mesh_uvs(
+                    cls._get_model_mesh(builder, keyframe)))
+
+        full_masks = (True,) * len(masks)
+        for i in range(len(masks)):
+            builder.set_mask(i, True)
+        full = cls.get_builder_topology(builder, full_masks, uv_set, keyframe,
+                                        builder_type, builder_version)
+        removed = np.zeros(len(full[0]), dtype=np.bool_)
+        for i, m in enumerate(masks):
+            if not m:
+                removed |= cls._get_part_faces(builder, key, i,
+                                               len(masks), full)
+        for i, m in enumerate(masks):
+            builder.set_mask(i, m)
+        return meshes.FBMeshTopologyCache.put(
+            key, *meshes.faces_subset(*full, ~removed))
 
-        # Warning! our autosmooth settings work on Shading Flat!
-        # mesh.use_auto_smooth = True
-        # mesh.auto_smooth_angle = math.pi
+    @classmethod
+    def _builder_uv_sets(cls, builder_type, uv_set):
+        """ Only FaceBuilder has all UV sets """
+        if builder_type == BuilderType.FaceBuilder:
+            return Config.uv_sets
+        return tuple((k, name) for k, name in Config.uv_sets if k == uv_set)
+
+    @classmethod
+    def uv_layer_name(cls, uv_set):
+        return dict(Config.uv_sets).get(uv_set, uv_set)
+
+    @classmethod
+    def _fill_builder_mesh(cls, builder, mesh, masks, uv_set, keyframe,
+                           builder_type, builder_version):
+        if builder_type is None:
+            builder_type = cls.get_builder_type()
+        if builder_version is None:
+            builder_version = cls.get_builder_version()
+        for i, m in enumerate(masks):
+            builder.set_mask(i, m)
+
+        if keyframe is not None:
+            vertices = builder.applied_args_model_vertices_at(keyframe)
+        else:
+            vertices = builder.applied_args_vertices()
+
+        uv_layers = []
+        for uv_key, uv_name in cls._builder_uv_sets(builder_type, uv_set):
+            cls._select_builder_uv_set(builder, uv_key)
+            face_sizes, face_indices, uvs = cls._checked_topology(
+                builder, len(vertices), masks, uv_key, keyframe,
+                builder_type, builder_version)
+            uv_layers.append((uv_name, uvs))
+        cls._select_builder_uv_set(builder, uv_set)
 
+        logger = logging.getLogger(__name__)
+        logger.debug("TOPOLOGY CACHE HITS: {} MISSES: {}".format(
+            meshes.FBMeshTopologyCache.hits(),
+            meshes.FBMeshTopologyCache.misses()))
+
+        meshes.fill_mesh_geometry(
+            mesh, meshes.builder_to_blender_coords(vertices),
+            face_sizes, face_indices)
+        meshes.add_uv_layers(mesh, uv_layers)
+        meshes.select_uv_layer(mesh, cls.uv_layer_name(uv_set))
+
+        # Exact builder normals are optional, see update_exact_normals
         return mesh
 
+    @classmethod
+    def get_builder_arrays(cls, builder, masks=(), uv_set='uv0',
+                           keyframe=None, builder_type=None,
+                           builder_version=None):
+        """ Builder coords vertices, face sizes, face indices and uvs """
+        for i, m in enumerate(masks):
+            builder.set_mask(i, m)
+        cls._select_builder_uv_set(builder, uv_set)
+        if keyframe is not None:
+            vertices = builder.applied_args_model_vertices_at(keyframe)
+        else:
+            vertices = builder.applied_args_vertices()
+        face_sizes, face_indices, uvs = cls._checked_topology(
+            builder, len(vertices), masks, uv_set, keyframe,
+            builder_type, builder_version)
+        return (np.asarray(vertices, dtype=np.float32),
+                face_sizes, face_indices, uvs)
+
+    @classmethod
+    def get_builder_normals(cls, builder, masks=(), keyframe=None,
+                            builder_version=None):
+        """ Per-vertex builder normals in Blender coords """
+        builder_type = cls.get_builder_type()
+        key = meshes.FBMeshTopologyCache.make_key(
+            builder_type, cls._model_version(builder_type, builder_version),
+            masks)
+        me = cls._get_model_mesh(builder, keyframe)
+        corner_vertices = meshes.FBMeshTopologyCache.get_corner_vertices(key)
+        if corner_vertices is not None and \
+                len(corner_vertices) > 0 and \
+                corner_vertices.max() >= me.points_count():
+            logger = logging.getLogger(__name__)
+            logger.warning("CORNERS CACHE MISMATCH: {}".format(key))
+            meshes.FBMeshTopologyCache.invalidate(builder_type)
+            corner_vertices = None
+        if corner_vertices is None:
+            _, face_indices = meshes.get_mesh_faces(me)
+            corner_vertices = meshes.FBMeshTopologyCache.put_corner_vertices(
+                key, face_indices)
+        return meshes.builder_to_blender_coords(
+            meshes.get_mesh_normals(me, corner_vertices))
+
+    @classmethod
+    def update_exact_normals(cls, head):
+        """ Apply builder normals to head mesh when head uses them """
+        mesh = head.headobj.data
+        if not head.exact_normals:
+            meshes.disable_custom_normals(mesh)
+            return
+        settings = get_main_settings()
+        keyframe = None
+        if head.should_use_emotions() and settings.current_camnum >= 0:
+            keyframe = head.get_keyframe(settings.current_camnum)
+        fb = cls.get_builder()
+        for i, m in enumerate(head.get_masks()):
+            fb.set_mask(i, m)
+        meshes.set_custom_normals(
+            mesh, cls.get_builder_normals(fb, head.get_masks(), keyframe,
+                                          head.mod_ver))
+
+    @classmethod
+    def get_builder_mesh(cls, builder, mesh_name='keentools_mesh',
+                         masks=(), uv_set='uv0', keyframe=None,
+                         builder_type=None, builder_version=None):
+        """ Empty masks mean default builder masks (fresh builder only).
+        Builder type and version are taken from current builder if None """
+        mesh = bpy.data.meshes.new(mesh_name)
+        return cls._fill_builder_mesh(builder, mesh, masks, uv_set, keyframe,
+                                      builder_type, builder_version)
+
+    @classmethod
+    def refill_builder_mesh(cls, builder, mesh, masks=(), uv_set='uv0',
+                            keyframe=None, builder_version=None):
+        """ Replace geometry of existing mesh keeping the datablock,
+        its materials and users. False if Blender can't do it in place """
+        if not meshes.clear_mesh_geometry(mesh):
+            return False
+        cls._fill_builder_mesh(builder, mesh, masks, uv_set, keyframe,
+                               None, builder_version)
+        return True
+
+    @classmethod
+    def _template_mesh_name(cls, builder_type):
+        return '{}_{}'.format(Config.template_mesh_prefix, builder_type)
+
+    @classmethod
+    def _template_signature(cls, builder_type):
+        """ Template is stale when addon, core or model version changes """
+        try:
+            ver = pkt.module().version
+            core_ver = '{}.{}.{}'.format(ver.major, ver.minor, ver.patch)
+        except AttributeError:
+            core_ver = 'unknown'
+        model_ver = Config.unknown_mod_ver
+        if builder_type == BuilderType.FaceBuilder:
+            model_ver = pkt.module().FaceBuilder.latest_face_version()
+        return '{}|{}|{}|{}'.format(Config.addon_version, core_ver,
+                                    builder_type, model_ver)
+
+    @classmethod
+    def get_template_mesh(cls, builder_type):
+        """ Hidden fake-user mesh with default builder geometry """
+        logger = logging.getLogger(__name__)
+        name = cls._template_mesh_name(builder_type)
+        signature = cls._template_signature(builder_type)
+        prop_name = Config.template_signature_prop_name[0]
+
+        template = bpy.data.meshes.get(name)
+        if template is not None:
+            if len(template.vertices) > 0 and \
+                    attrs.get_safe_custom_attribute(
+                        template, prop_name) == signature:
+                return template
+            logger.debug("TEMPLATE MESH IS STALE: {}".format(name))
+            meshes.FBMeshGeomUpdater.forget(template)
+            bpy.data.meshes.remove(template, do_unlink=True)
+
+        logger.debug("CREATE TEMPLATE MESH: {}".format(name))
+        # Separate builder, so the current one need not be restored
+        builder = UniBuilder(builder_type, Config.unknown_mod_ver)
+        template = cls.get_builder_mesh(
+            builder.get_builder(), name,
+            builder_type=builder_type,
+            builder_version=Config.unknown_mod_ver)
+        template.name = name
+        template.use_fake_user = True
+        attrs.set_custom_attribute(template, prop_name, signature)
+        return template
+
     @classmethod
     def universal_mesh_loader(cls, builder_type, mesh_name='keentools_mesh',
                               masks=(), uv_set='uv0'):
-        stored_builder_type = FBLoader.get_builder_type()
-        stored_builder_version = FBLoader.get_builder_version()
-        builder = cls.new_builder(builder_type, Config.unknown_mod_ver)
-
-        mesh = cls.get_builder_mesh(builder, mesh_name, masks, uv_set,
-                                    keyframe=None)
-        # Restore builder
-        cls.new_builder(stored_builder_type, stored_builder_version)
+        """ New head starts with a fresh builder, so keyframes and pins
+        of the previous head do not leak into it """
+        cls.new_builder(cls.get_builder_type(), cls.get_builder_version())
+        if masks:
+            builder = UniBuilder(builder_type, Config.unknown_mod_ver)
+            return cls.get_builder_mesh(
+                builder.get_builder(), mesh_name, masks, uv_set,
+                builder_type=builder_type,
+                builder_version=Config.unknown_mod_ver)
+
+        mesh = cls.get_template_mesh(builder_type).copy()
+        # Pointer of a removed mesh may be reused by the copy
+        meshes.FBMeshGeomUpdater.forget(mesh)
+        mesh.use_fake_user = False
+        meshes.select_uv_layer(mesh, cls.uv_layer_name(uv_set))
+        if Config.template_signature_prop_name[0] in mesh.keys():
+            del mesh[Config.template_signature_prop_name[0]]
+        mesh.name = mesh_name
         return mesh
 
     @classmethod
     def load_model_from_head(cls, head):
-        fb = cls.get_builder()
-        if not fb.deserialize(head.get_serial_str()):
+        serial_str = head.get_serial_str()
+        if not cls.deserialize(serial_str):
             logger = logging.getLogger(__name__)
-            logger.warning('DESERIALIZE ERROR: {}'.format(
-                head.get_serial_str()))
+            logger.warning('DESERIALIZE ERROR: {}'.format(serial_str))
             return False
         return True
 
@@ -436,7 +744,7 @@ class FBLoader:
         cls.place_cameraobj(kid, camobj, headobj)
         # Load pins from model
         vp = cls.viewport()
-        vp.pins().set_pins(vp.img_points(fb, kid))
+        vp.pins().set_pins(vp.img_points(fb, kid), kid)
         vp.pins().reset_current_pin()
         logger.debug("LOAD MODEL END")
 
@@ -457,7 +765,7 @@ class FBLoader:
         fb = cls.get_builder()
         # Load pins from model
         vp = cls.viewport()
-        vp.pins().set_pins(vp.img_points(fb, kid))
+        vp.pins().set_pins(vp.img_points(fb, kid), kid)
         vp.pins().reset_current_pin()
 
     @classmethod
@@ -559,6 +867,9 @@ class FBLoader:
         mode = _auto_focal_estimation_mode_and_fixes()
         fb.set_focal_length_estimation_mode(mode)
 
+        FBExpressionCache.invalidate()
+        FBProjectedVertices.invalidate()
+        cls._solve_version += 1
         try:
             fb.solve_for_current_pins(kid)
         except pkt.module().UnlicensedException:
@@ -607,10 +918,9 @@ class FBLoader:
             logger.debug('IMAGE_SIZE_BY_PROJECTION: {}x{}'.format(w, h))
             dx = (h - w) * 0.5
             dy = (w - h) * 0.5
-            for i in range(fb.pins_count(kid)):
-                pin = fb.pin(kid, i)
-                x, y = pin.img_pos
-                fb.move_pin(kid, i, (x + dx, y + dy))
+            img_pos = FBPinCache.img_pos(fb, kid)
+            cls.move_pins(kid, range(len(img_pos)),
+                          (img_pos + (dx, dy)).tolist())
         # Save info
         head.set_serial_str(fb.serialize())
 
@@ -703,6 +1013,7 @@ class FBLoader:
         camera.set_keyframe(kid)
         projection = camera.get_projection_matrix()
 
+        cls.builder_keyframe_changed(kid)
         fb.set_centered_geo_keyframe(kid, projection,
                                      camera.get_oriented_image_size())
 
@@ -51,5 +51,6 @@ CLASSES_TO_REGISTER = (FB_MT_ProperViewMenu, # menus
                        FB_OT_SingleFilebrowser,  # filedialog
                        FB_OT_SingleFilebrowserExec,
                        FB_OT_TextureFileExport,
+                       FB_OT_HeadFileExport,
                        FB_OT_MultipleFilebrowser,
                        FB_OT_MultipleFilebrowserExec)
@@ -31,6 +31,7 @@ from ..utils.exif_reader import (read_exif_to_camera,
                                  auto_setup_camera_from_exif)
 from ..utils.other import restore_ui_elements
 from ..utils.materials import find_tex_by_name
+from ..utils.export import export_head
 
 
 class FB_OT_SingleFilebrowserExec(Operator):
@@ -185,6 +186,59 @@ class FB_OT_TextureFileExport(Operator, ExportHelper):
         return {'RUNNING_MODAL'}
 
 
+def update_head_format(self, context):
+    self.filename_ext = '.' + self.file_format.lower()
+
+
+class FB_OT_HeadFileExport(Operator, ExportHelper):
+    bl_idname = Config.fb_head_file_export_idname
+    bl_label = "Export head"
+    bl_description = "Export the head model with its texture to a file " \
+                     "directly from FaceBuilder data"
+    bl_options = {'REGISTER', 'INTERNAL'}
+
+    filter_glob: bpy.props.StringProperty(
+        default='*.obj;*.ply;*.glb',
+        options={'HIDDEN'}
+    )
+
+    file_format: bpy.props.EnumProperty(name="Model file format", items=[
+        ('OBJ', 'OBJ', 'Wavefront OBJ with MTL and PNG texture', 0),
+        ('PLY', 'PLY', 'Binary PLY with PNG texture', 1),
+        ('GLB', 'GLB', 'Binary glTF with embedded texture', 2),
+    ], description="Choose model file format", update=update_head_format)
+
+    use_texture: bpy.props.BoolProperty(
+        name="Export texture",
+        description="Save the created texture with the model",
+        default=True)
+
+    filename_ext: bpy.props.StringProperty(default=".obj")
+
+    headnum: bpy.props.IntProperty(name='Head index in scene', default=0)
+
+    def check(self, context):
+        filepath = bpy.path.ensure_ext(
+            os.path.splitext(self.filepath)[0], self.filename_ext)
+        if filepath != self.filepath:
+            self.filepath = filepath
+            return True
+        return False
+
+    def draw(self, context):
+        layout = self.layout
+        layout.label(text='Model file format')
+        layout.prop(self, 'file_format', expand=True)
+        layout.prop(self, 'use_texture')
+
+    def execute(self, context):
+        logger = logging.getLogger(__name__)
+        logger.debug("START EXPORT HEAD: {}".format(self.filepath))
+        if not export_head(self.headnum, self.filepath, self.use_texture):
+            return {'CANCELLED'}
+        return {'FINISHED'}
+
+
 class FB_OT_MultipleFilebrowserExec(Operator):
     bl_idname = Config.fb_multiple_filebrowser_exec_idname
     bl_label = "Open Images"
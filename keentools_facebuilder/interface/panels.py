@@ -408,6 +408,9 @@ class FB_PT_ViewsPanel(Panel):
 
         box = layout.box()
         box.prop(settings.get_head(headnum), 'use_emotions')
+        if head.should_use_emotions():
+            op = box.operator(Config.fb_export_expressions_idname)
+            op.headnum = headnum
 
         box = layout.box()
         for i, camera in enumerate(head.cameras):
@@ -544,6 +547,12 @@ class FB_PT_Model(Panel):
         row.prop(head, 'check_neck')
         row.prop(head, 'check_nose')
 
+        layout.prop(head, 'exact_normals')
+
+        op = layout.operator(Config.fb_head_file_export_idname,
+                             text="Export head", icon='EXPORT')
+        op.headnum = headnum
+
 
 class FB_PT_TexturePanel(Panel):
     bl_idname = Config.fb_texture_panel_idname
@@ -707,3 +716,4 @@ class FB_PT_PinSettingsPanel(Panel):
         box = layout.box()
         box.prop(settings, 'pin_size', slider=True)
         box.prop(settings, 'pin_sensitivity', slider=True)
+        box.prop(settings, 'pin_snapping')
@@ -29,6 +29,8 @@ from bpy.props import (
 from .utils import cameras, manipulate, materials, coords
 from .utils.manipulate import check_settings
 from .utils.attrs import get_obj_collection, safe_delete_collection
+from .utils.meshes import FBMeshTopologyCache
+from .utils.expressions import FBExpressionCache
 from .fbloader import FBLoader
 from .config import get_main_settings, get_operators, Config
 from .utils.exif_reader import (read_exif_from_camera,
@@ -193,9 +195,10 @@ class FB_OT_Unmorph(Operator):
             settings.get_head(headnum), 'Before Reset')
 
         fb.unmorph()
+        FBLoader.builder_state_changed()
 
         for i, camera in enumerate(head.cameras):
-            fb.remove_pins(camera.get_keyframe())
+            FBLoader.remove_pins(camera.get_keyframe())
             camera.pins_count = 0
 
         if settings.pinmode:
@@ -233,13 +236,12 @@ class FB_OT_RemovePins(Operator):
         headnum = self.headnum
         camnum = self.camnum
 
-        fb = FBLoader.get_builder()
         kid = settings.get_keyframe(headnum, camnum)
         FBLoader.fb_save(headnum, camnum)
         manipulate.push_head_in_undo_history(
             settings.get_head(headnum), 'Before Remove pins')
 
-        fb.remove_pins(kid)
+        FBLoader.remove_pins(kid)
         FBLoader.solve(headnum, camnum)  # is it needed?
 
         FBLoader.fb_save(headnum, camnum)
@@ -347,6 +349,7 @@ class FB_OT_DeleteCamera(Operator):
         kid = camera.get_keyframe()
         fb = FBLoader.get_builder()
         fb.remove_keyframe(kid)
+        FBLoader.builder_keyframe_changed(kid)
 
         head = settings.get_head(headnum)
         camera.delete_cam_image()
@@ -539,6 +542,40 @@ class FB_OT_BakeTexture(Operator):
         return {'FINISHED'}
 
 
+class FB_OT_ExportExpressions(Operator):
+    bl_idname = Config.fb_export_expressions_idname
+    bl_label = "Expressions to Shape Keys"
+    bl_options = {'REGISTER', 'UNDO'}
+    bl_description = "Create a copy of the head with a shape key " \
+                     "of facial expression for every view"
+
+    headnum: IntProperty(default=0)
+
+    def draw(self, context):
+        pass
+
+    def execute(self, context):
+        settings = get_main_settings()
+        head = settings.get_head(self.headnum)
+        if head is None or not head.should_use_emotions():
+            self.report({'ERROR'}, "Facial expressions are not allowed")
+            return {'CANCELLED'}
+
+        wm = context.window_manager
+        wm.progress_begin(0, len(head.cameras))
+        try:
+            count = manipulate.export_expressions_to_shape_keys(
+                self.headnum, wm.progress_update)
+        finally:
+            wm.progress_end()
+
+        if count < 0:
+            self.report({'ERROR'}, "Shape keys can not be created")
+            return {'CANCELLED'}
+        self.report({'INFO'}, "{} shape keys created".format(count))
+        return {'FINISHED'}
+
+
 class FB_OT_DeleteTexture(Operator):
     bl_idname = Config.fb_delete_texture_idname
     bl_label = "Delete texture"
@@ -652,6 +689,8 @@ class FB_OT_ResetExpression(Operator):
         fb = FBLoader.get_builder()
         fb.reset_to_neutral_emotions(
             head.get_keyframe(settings.current_camnum))
+        FBExpressionCache.invalidate_keyframe(
+            head.get_keyframe(settings.current_camnum))
 
         FBLoader.save_only(self.headnum)
         FBLoader.fb_redraw(self.headnum, settings.current_camnum)
@@ -752,6 +791,7 @@ class FB_OT_UninstallCore(bpy.types.Operator):
         import keentools_facebuilder.blender_independent_packages.pykeentools_loader as pkt
         logger.debug("START CORE UNINSTALL")
         pkt.uninstall()
+        FBMeshTopologyCache.invalidate()
         logger.debug("FINISH CORE UNINSTALL")
         pkt.reset_cached_is_installed()
         return {'FINISHED'}
@@ -774,6 +814,7 @@ CLASSES_TO_REGISTER = (FB_OT_SelectHead,
                        FB_OT_DeleteCamera,
                        FB_OT_AddonSettings,
                        FB_OT_BakeTexture,
+                       FB_OT_ExportExpressions,
                        FB_OT_DeleteTexture,
                        FB_OT_RotateImageCW,
                        FB_OT_RotateImageCCW,
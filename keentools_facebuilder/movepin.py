@@ -19,6 +19,7 @@
 import logging
 
 import bpy
+import numpy as np
 
 from .utils import cameras, manipulate, coords
 from .fbloader import FBLoader
@@ -56,6 +57,11 @@ class FB_OT_MovePin(bpy.types.Operator):
 
     pinx: bpy.props.FloatProperty(default=0)
     piny: bpy.props.FloatProperty(default=0)
+    # Shift click toggles pin selection, shift drag selects by box
+    extend_selection: bpy.props.BoolProperty(default=False)
+
+    # Image space corner where box selection started
+    _box_start = None
 
     # Headnum & camnum unstable because of Blender operator params may changing
     # Possible we need store initial values, but unsure
@@ -74,10 +80,13 @@ class FB_OT_MovePin(bpy.types.Operator):
         kid = settings.get_keyframe(headnum, camnum)
 
         x, y = coords.get_image_space_coord(mouse_x, mouse_y, context)
+        if settings.pin_snapping:
+            head = settings.get_head(headnum)
+            x, y = FBLoader.viewport().snap_to_vertex(
+                FBLoader.get_builder(), head.headobj,
+                head.get_camera(camnum).camobj, kid, x, y)
 
-        pin = FBLoader.get_builder().add_pin(
-            kid, (coords.image_space_to_frame(x, y))
-        )
+        pin = FBLoader.add_pin(kid, coords.image_space_to_frame(x, y))
         if pin is not None:
             logger.debug("ADD PIN")
             vp = FBLoader.viewport()
@@ -124,15 +133,51 @@ class FB_OT_MovePin(bpy.types.Operator):
 
         settings.pinmode = True
         x, y = coords.get_image_space_coord(mouse_x, mouse_y, context)
-        vp.pins().set_current_pin((x, y))
+        pins = vp.pins()
+        nearest, dist2 = pins.nearest_pin(x, y, vp.tolerance_dist2())
 
-        nearest, dist2 = coords.nearest_point(x, y, vp.pins().arr())
+        if self.extend_selection:
+            return self._start_selection(context, nearest, x, y)
 
-        if nearest >= 0 and dist2 < vp.tolerance_dist2():
-            vp.pins().set_current_pin_num(nearest)
+        pins.set_current_pin((x, y))
+        if nearest >= 0:
+            # Drag of selected pin moves all selected ones
+            if not pins.is_selected(nearest):
+                pins.clear_selection()
+            pins.set_current_pin_num(nearest)
         else:
+            pins.clear_selection()
             return self._new_pin(context, mouse_x, mouse_y)
 
+    def _start_selection(self, context, nearest, x, y):
+        vp = FBLoader.viewport()
+        if nearest >= 0:
+            vp.pins().toggle_selected(nearest)
+            vp.create_batch_2d(context)
+            return {'FINISHED'}
+        self._box_start = (x, y)
+        vp.update_selection_box(context, self._box_start, (x, y))
+        return None
+
+    def on_box_move(self, context, mouse_x, mouse_y):
+        x, y = coords.get_image_space_coord(mouse_x, mouse_y, context)
+        FBLoader.viewport().update_selection_box(
+            context, self._box_start, (x, y))
+        if not bpy.app.background:
+            context.area.tag_redraw()
+        return {'RUNNING_MODAL'}
+
+    def on_box_release(self, context, mouse_x, mouse_y):
+        x, y = coords.get_image_space_coord(mouse_x, mouse_y, context)
+        vp = FBLoader.viewport()
+        vp.pins().select_in_rect(*self._box_start, x, y, extend=True)
+        self._box_start = None
+        vp.update_selection_box(context)
+        vp.create_batch_2d(context)
+        if not bpy.app.background:
+            context.area.tag_redraw()
+        return {'FINISHED'}
+
     def _push_previous_state(self):
         logger = logging.getLogger(__name__)
         settings = get_main_settings()
@@ -152,7 +197,7 @@ class FB_OT_MovePin(bpy.types.Operator):
             cam.model_mat = cam.tmp_model_mat
             head.set_serial_str(head.get_tmp_serial_str())
 
-            if not fb.deserialize(head.get_serial_str()):
+            if not FBLoader.deserialize(head.get_serial_str()):
                 logger.warning('DESERIALIZE ERROR: ', head.get_serial_str())
 
             FBLoader.update_all_camera_positions(headnum)
@@ -164,7 +209,7 @@ class FB_OT_MovePin(bpy.types.Operator):
             head.set_serial_str(serial_str)
             cam.model_mat = model_mat
 
-            if not fb.deserialize(head.get_serial_str()):
+            if not FBLoader.deserialize(head.get_serial_str()):
                 logger.warning("DESERIALIZE ERROR: {}", head.get_serial_str())
         else:
             # There was only one click
@@ -182,9 +227,10 @@ class FB_OT_MovePin(bpy.types.Operator):
         x, y = coords.get_image_space_coord(mouse_x, mouse_y, context)
         vp = FBLoader.viewport()
         pins = vp.pins()
-        if pins.current_pin() is not None:
+        if pins.current_pin() is not None \
+                and not pins.is_selected(pins.current_pin_num()):
             # Move current 2D-pin
-            pins.arr()[pins.current_pin_num()] = (x, y)
+            pins.move_pin(pins.current_pin_num(), (x, y))
 
         pins.reset_current_pin()
         FBLoader.update_head_camera_focals(head)
@@ -200,19 +246,31 @@ class FB_OT_MovePin(bpy.types.Operator):
         manipulate.push_neutral_head_in_undo_history(head, kid, 'Pin Result.')
         # ---------
 
+        # Normals are not refreshed while dragging
+        FBLoader.update_exact_normals(head)
         # Load 3D pins
         vp.update_surface_points(fb, head.headobj, kid)
         return {'FINISHED'}
 
     @staticmethod
     def _pin_drag(kid, context, mouse_x, mouse_y):
-        fb = FBLoader.get_builder()
         x, y = coords.get_image_space_coord(mouse_x, mouse_y, context)
         pins = FBLoader.viewport().pins()
         pins.set_current_pin((x, y))
         pin_idx = pins.current_pin_num()
-        pins.arr()[pin_idx] = (x, y)
-        fb.move_pin(kid, pin_idx, coords.image_space_to_frame(x, y))
+        if not pins.is_selected(pin_idx):
+            pins.move_pin(pin_idx, (x, y))
+            FBLoader.move_pin(kid, pin_idx, coords.image_space_to_frame(x, y))
+            return
+
+        # Group drag keeps offsets between selected pins
+        indices = pins.selected_indices()
+        offset = np.array((x, y)) - pins.arr()[pin_idx]
+        positions = pins.arr()[indices] + offset
+        for i, pos in zip(indices.tolist(), positions.tolist()):
+            pins.move_pin(i, pos)
+        FBLoader.move_pins(kid, indices,
+                           coords.image_space_to_frame_arr(positions).tolist())
 
     def on_mouse_move(self, context, mouse_x, mouse_y):
 
@@ -261,10 +319,10 @@ class FB_OT_MovePin(bpy.types.Operator):
 
         return self.on_default_modal()
 
-    @staticmethod
-    def on_default_modal():
+    def on_default_modal(self):
         logger = logging.getLogger(__name__)
-        if FBLoader.viewport().pins().current_pin() is not None:
+        if FBLoader.viewport().pins().current_pin() is not None \
+                or self._box_start is not None:
             return {"RUNNING_MODAL"}
         else:
             logger.debug("MOVE PIN FINISH")
@@ -303,6 +361,14 @@ class FB_OT_MovePin(bpy.types.Operator):
         mouse_x = event.mouse_region_x
         mouse_y = event.mouse_region_y
 
+        if self._box_start is not None:
+            if event.value == "RELEASE" and event.type == "LEFTMOUSE":
+                logger.debug("BOX SELECTION RELEASE")
+                return self.on_box_release(context, mouse_x, mouse_y)
+            if event.type == "MOUSEMOVE":
+                return self.on_box_move(context, mouse_x, mouse_y)
+            return self.on_default_modal()
+
         if event.value == "RELEASE" and event.type == "LEFTMOUSE":
             logger.debug("LEFT MOUSE RELEASE")
             return self.on_left_mouse_release(context, mouse_x, mouse_y)
@@ -22,6 +22,8 @@ from uuid import uuid4
 import bpy
 
 from .utils import manipulate, coords, cameras
+from .utils.meshes import FBMeshGeomUpdater
+from .utils.redraw import FBRedrawScheduler
 from .config import Config, get_main_settings, get_operators, ErrorType
 from .fbloader import FBLoader
 from .utils.other import FBStopShaderTimer, force_ui_redraw, hide_ui_elements
@@ -68,29 +70,49 @@ class FB_OT_PinMode(bpy.types.Operator):
             warn = getattr(get_operators(), Config.fb_warning_callname)
             warn('INVOKE_DEFAULT', msg=ErrorType.SceneDamaged)
 
-    def _coloring_special_parts(self, headobj, opacity):
-        settings = get_main_settings()
-        if settings.show_specials:
-            special_indices = FBLoader.viewport().get_special_indices(
-                FBLoader.get_builder_type())
-            special_color = (*settings.wireframe_special_color,
-                             opacity * settings.wireframe_opacity)
-            FBLoader.viewport().wireframer().init_special_areas(
-                headobj.data, special_indices, special_color)
-
-    def _init_wireframer_colors(self, opacity):
+    def _coloring_special_parts(self, headobj):
+        special_indices = FBLoader.viewport().get_special_indices(
+            FBLoader.get_builder_type())
+        FBLoader.viewport().wireframer().init_special_areas(
+            headobj.data, special_indices)
+
+    def _init_wireframer(self):
         settings = get_main_settings()
         head = settings.get_head(settings.current_headnum)
         headobj = head.headobj
 
         FBLoader.viewport().wireframer().init_geom_data(headobj)
-        FBLoader.viewport().wireframer().init_edge_indices(headobj)
 
-        FBLoader.viewport().wireframer().init_color_data(
-            (*settings.wireframe_color, opacity * settings.wireframe_opacity))
-        self._coloring_special_parts(headobj, opacity)
+        self._coloring_special_parts(headobj)
+        FBLoader.viewport().update_wireframe_colors()
 
         FBLoader.viewport().wireframer().create_batches()
+        FBRedrawScheduler.mark_dirty('colors')
+
+    @staticmethod
+    def _update_dirty_batches(context, head, kid):
+        """ Only batches with changed inputs are rebuilt,
+        so timer events in idle pinmode do almost nothing """
+        vp = FBLoader.viewport()
+        coords.get_camera_border(context)
+        FBRedrawScheduler.check_inputs(
+            pins=vp.pins().version(),
+            solve=FBLoader.solve_version(),
+            border=coords.FBCameraBorder.version(),
+            mesh=FBMeshGeomUpdater.version(head.headobj.data))
+        if FBRedrawScheduler.is_idle():
+            return False
+
+        if FBRedrawScheduler.need_rebuild('pins2d'):
+            vp.create_batch_2d(context)
+            FBRedrawScheduler.rebuilt('pins2d')
+        if FBRedrawScheduler.need_rebuild('residuals'):
+            vp.update_residuals(
+                FBLoader.get_builder(), context, head.headobj, kid)
+            FBRedrawScheduler.rebuilt('residuals')
+        if not bpy.app.background:
+            context.area.tag_redraw()
+        return True
 
     def _delete_found_pin(self, nearest, context):
         settings = get_main_settings()
@@ -99,9 +121,8 @@ class FB_OT_PinMode(bpy.types.Operator):
         head = settings.get_head(headnum)
         kid = settings.get_keyframe(headnum, camnum)
 
-        fb = FBLoader.get_builder()
-        fb.remove_pin(kid, nearest)
-        del FBLoader.viewport().pins().arr()[nearest]
+        FBLoader.remove_pin(kid, nearest)
+        FBLoader.viewport().pins().remove_pin(nearest)
         logging.debug("PIN REMOVED {}".format(nearest))
 
         if not FBLoader.solve(headnum, camnum):
@@ -129,6 +150,7 @@ class FB_OT_PinMode(bpy.types.Operator):
         head = settings.get_head(headnum)
 
         head.need_update = False
+        FBMeshGeomUpdater.invalidate(head.headobj.data)
         FBLoader.load_model(headnum)
         FBLoader.place_camera(headnum, camnum)
         FBLoader.load_pins(headnum, camnum)
@@ -139,8 +161,9 @@ class FB_OT_PinMode(bpy.types.Operator):
         coords.update_head_mesh(settings, fb, head)
 
         FBLoader.viewport().update_surface_points(fb, head.headobj, kid)
+        FBLoader.viewport().wireframer().invalidate_topology()
         FBLoader.shader_update(head.headobj)
-
+        FBRedrawScheduler.mark_all_dirty()
 
     def _on_right_mouse_press(self, context, mouse_x, mouse_y):
         vp = FBLoader.viewport()
@@ -148,14 +171,14 @@ class FB_OT_PinMode(bpy.types.Operator):
 
         x, y = coords.get_image_space_coord(mouse_x, mouse_y, context)
 
-        nearest, dist2 = coords.nearest_point(x, y, vp.pins().arr())
-        if nearest >= 0 and dist2 < FBLoader.viewport().tolerance_dist2():
+        nearest, dist2 = vp.pins().nearest_pin(x, y, vp.tolerance_dist2())
+        if nearest >= 0:
             return self._delete_found_pin(nearest, context)
 
         FBLoader.viewport().create_batch_2d(context)
         return {"RUNNING_MODAL"}
 
-    def _on_left_mouse_press(self, context, mouse_x, mouse_y):
+    def _on_left_mouse_press(self, context, mouse_x, mouse_y, shift=False):
         FBLoader.viewport().update_view_relative_pixel_size(context)
 
         if not coords.is_in_area(context, mouse_x, mouse_y):
@@ -167,7 +190,8 @@ class FB_OT_PinMode(bpy.types.Operator):
             op = getattr(get_operators(), Config.fb_movepin_callname)
             op('INVOKE_DEFAULT', pinx=mouse_x, piny=mouse_y,
                headnum=settings.current_headnum,
-               camnum=settings.current_camnum)
+               camnum=settings.current_camnum,
+               extend_selection=shift)
             return {'PASS_THROUGH'}
 
         return {'PASS_THROUGH'}
@@ -239,6 +263,7 @@ class FB_OT_PinMode(bpy.types.Operator):
                 kfnum = cam.get_keyframe()
                 logger.debug("UPDATE KEYFRAME: {}".format(kfnum))
                 if not fb.is_key_at(kfnum):
+                    FBLoader.builder_keyframe_changed(kfnum)
                     fb.set_keyframe(kfnum, cam.get_model_mat(),
                                     cam.get_projection_matrix(),
                                     cam.get_oriented_image_size())
@@ -266,8 +291,11 @@ class FB_OT_PinMode(bpy.types.Operator):
             hide_ui_elements()
 
             logger.debug("START SHADERS")
-            self._init_wireframer_colors(settings.overall_opacity)
+            vp.wireframer().invalidate_topology()
+            self._init_wireframer()
             vp.create_batch_2d(context)
+            FBRedrawScheduler.mark_all_dirty()
+            FBRedrawScheduler.reset_counters()
             logger.debug("REGISTER SHADER HANDLERS")
             vp.register_handlers(args, context)
 
@@ -278,7 +306,7 @@ class FB_OT_PinMode(bpy.types.Operator):
             FBStopShaderTimer.start(settings.pinmode_id)
         else:
             logger.debug("SHADER UPDATE ONLY")
-            self._init_wireframer_colors(settings.overall_opacity)
+            self._init_wireframer()
 
         vp.update_surface_points(FBLoader.get_builder(), headobj, kid)
         manipulate.push_neutral_head_in_undo_history(head, kid,
@@ -298,7 +326,7 @@ class FB_OT_PinMode(bpy.types.Operator):
             0.0 if settings.overall_opacity > 0.5 else 1.0
         logger.debug("OVERALL_OPACITY BY TAB {}".format(
             settings.overall_opacity))
-        self._init_wireframer_colors(settings.overall_opacity)
+        FBLoader.viewport().update_wireframe_colors()
         force_ui_redraw("VIEW_3D")
 
     def _modal_should_finish(self, context, event):
@@ -369,9 +397,16 @@ class FB_OT_PinMode(bpy.types.Operator):
             self._wireframe_view_toggle()
             return {'RUNNING_MODAL'}
 
+        vp = FBLoader.viewport()
+        if event.type == 'MOUSEMOVE' and vp.pins().current_pin() is None:
+            if vp.update_hover(context, event.mouse_region_x,
+                               event.mouse_region_y):
+                context.area.tag_redraw()
+
         if event.value == 'PRESS' and event.type == 'LEFTMOUSE':
             return self._on_left_mouse_press(
-                context, event.mouse_region_x, event.mouse_region_y)
+                context, event.mouse_region_x, event.mouse_region_y,
+                event.shift)
 
         if event.value == 'PRESS' and event.type == 'RIGHTMOUSE':
             return self._on_right_mouse_press(
@@ -392,15 +427,12 @@ class FB_OT_PinMode(bpy.types.Operator):
             logger.debug("UNDO CALL DETECTED")
             self._undo_detected()
 
-        vp = FBLoader.viewport()
         if not (vp.wireframer().is_working()):
             logger.debug("WIREFRAME IS OFF")
             FBLoader.out_pinmode(headnum)
             return {'FINISHED'}
 
-        vp.create_batch_2d(context)
-        vp.update_residuals(
-            FBLoader.get_builder(), context, head.headobj, kid)
+        self._update_dirty_batches(context, head, kid)
 
         if vp.pins().current_pin() is not None:
             return {"RUNNING_MODAL"}
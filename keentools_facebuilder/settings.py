@@ -35,10 +35,11 @@ from bpy.props import (
     EnumProperty
 )
 from bpy.types import PropertyGroup
-from .utils import coords
+from .utils import coords, meshes
 from . fbdebug import FBDebug
 from . config import Config, get_main_settings, get_operators
 from .utils.manipulate import what_is_state
+from .utils.other import force_ui_redraw
 
 
 def update_emotions(self, context):
@@ -54,11 +55,8 @@ def update_emotions(self, context):
 
 
 def update_wireframe(self, context):
-    settings = get_main_settings()
-    headnum = settings.current_headnum
-    head = settings.get_head(headnum)
-    FBLoader.viewport().update_wireframe(
-        FBLoader.get_builder_type(), head.headobj)
+    FBLoader.viewport().update_wireframe_colors()
+    force_ui_redraw("VIEW_3D")
 
 
 def update_pin_sensitivity(self, context):
@@ -145,11 +143,26 @@ def update_mesh_parts(self, context):
 
     old_mesh = head.headobj.data
     FBLoader.load_model(headnum)
+    # Same datablock is refilled from cached topology subset
+    if FBLoader.refill_builder_mesh(FBLoader.get_builder(), old_mesh,
+                                    head.get_masks(),
+                                    uv_set=head.tex_uv_shape,
+                                    keyframe=keyframe,
+                                    builder_version=head.mod_ver):
+        FBLoader.update_exact_normals(head)
+        if settings.pinmode:
+            FBLoader.viewport().wireframer().init_geom_data(
+                head.headobj, (tuple(head.get_masks()), head.tex_uv_shape))
+            FBLoader.viewport().update_wireframe(
+                FBLoader.get_builder_type(), head.headobj)
+        return
+
     # Create new mesh
     mesh = FBLoader.get_builder_mesh(FBLoader.get_builder(), 'FBHead_tmp_mesh',
                                      head.get_masks(),
                                      uv_set=head.tex_uv_shape,
-                                     keyframe=keyframe)
+                                     keyframe=keyframe,
+                                     builder_version=head.mod_ver)
     try:
         # Copy old material
         if old_mesh.materials:
@@ -159,17 +172,37 @@ def update_mesh_parts(self, context):
     head.headobj.data = mesh
     if settings.pinmode:
         # Update wireframe structures
-        FBLoader.viewport().wireframer().init_geom_data(head.headobj)
-        FBLoader.viewport().wireframer().init_edge_indices(head.headobj)
+        FBLoader.viewport().wireframer().init_geom_data(
+            head.headobj, (tuple(head.get_masks()), head.tex_uv_shape))
         FBLoader.viewport().update_wireframe(
             FBLoader.get_builder_type(), head.headobj)
 
     mesh_name = old_mesh.name
     # Delete old mesh
+    meshes.FBMeshGeomUpdater.forget(old_mesh)
     bpy.data.meshes.remove(old_mesh, do_unlink=True)
     mesh.name = mesh_name
 
 
+def update_exact_normals(self, context):
+    state, headnum = what_is_state()
+    if headnum < 0 or self.headobj is None:
+        return
+    FBLoader.load_model(headnum)
+    FBLoader.update_exact_normals(self)
+
+
+def update_uv_layer(self, context):
+    """ All UV sets are stored as mesh UV layers, switch active one """
+    headobj = self.headobj
+    if headobj is not None and headobj.type == 'MESH' and \
+            meshes.select_uv_layer(headobj.data,
+                                   FBLoader.uv_layer_name(self.tex_uv_shape)):
+        return
+    # Mesh created before UV layers were stored
+    update_mesh_parts(self, context)
+
+
 class FBExifItem(PropertyGroup):
     info_message: StringProperty(name="EXIF Info Message", default="")
     sizes_message: StringProperty(name="EXIF Sizes Message", default="")
@@ -536,6 +569,12 @@ class FBHeadItem(PropertyGroup):
     tmp_serial_str: StringProperty(name="Temporary Serialization", default="")
     need_update: BoolProperty(name="Mesh need update", default=False)
 
+    exact_normals: BoolProperty(
+        name="Exact normals",
+        description="Use model normals for shading instead of "
+                    "ones calculated by Blender",
+        default=False, update=update_exact_normals)
+
     tex_uv_shape: EnumProperty(name="UV", items=[
                 ('uv0', 'Butterfly', 'A one-seam layout for common use',
                  'UV', 0),
@@ -544,7 +583,7 @@ class FBHeadItem(PropertyGroup):
                 ('uv2', 'Spherical', 'A wrap-around layout', 'UV', 2),
                 ('uv3', 'Maxface',
                  'Maximum face resolution, low uniformness', 'UV', 3),
-                ], description="UV Layout", update=update_mesh_parts)
+                ], description="UV Layout", update=update_uv_layer)
 
     use_exif: BoolProperty(
         name="Use EXIF if available in file",
@@ -750,6 +789,10 @@ class FBSceneSettings(PropertyGroup):
         name="Pin handle radius",
         default=Config.default_point_sensitivity, min=1.0, max=100.0,
         update=update_pin_sensitivity)
+    pin_snapping: BoolProperty(
+        description="Place new pins at the nearest model vertex "
+                    "inside pin handle radius",
+        name="Snap to vertices", default=False)
 
     # Other settings
     rigidity: FloatProperty(
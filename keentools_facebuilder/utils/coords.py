@@ -18,7 +18,10 @@
 import numpy as np
 import math
 import bpy
+from ..config import Config
 from . fake_context import get_fake_context
+from . expressions import FBExpressionCache
+from . meshes import FBMeshGeomUpdater
 
 
 def nearest_point(x, y, points, dist=4000000):  # dist squared
@@ -33,21 +36,21 @@ def nearest_point(x, y, points, dist=4000000):  # dist squared
 
 
 def update_head_mesh_geom(obj, geom):
-    mesh = obj.data
-    rot = np.array([[1., 0., 0.], [0., 0., 1.], [0., -1., 0]])
-    npbuffer = geom @ rot
-    mesh.vertices.foreach_set('co', npbuffer.ravel())
-    mesh.update()
+    FBMeshGeomUpdater.set_builder_vertices(obj.data, geom)
+
+
+def set_head_mesh_vertices(obj, verts):
+    """ Vertices are already in Blender coords """
+    FBMeshGeomUpdater.set_vertices(obj.data, verts)
 
 
 def update_head_mesh_neutral(fb, headobj):
-    geom = fb.applied_args_vertices()
-    update_head_mesh_geom(headobj, geom)
+    set_head_mesh_vertices(headobj, FBExpressionCache.get_vertices(fb))
 
 
 def update_head_mesh_emotions(fb, headobj, keyframe):
-    geom = fb.applied_args_model_vertices_at(keyframe)
-    update_head_mesh_geom(headobj, geom)
+    set_head_mesh_vertices(
+        headobj, FBExpressionCache.get_vertices(fb, keyframe))
 
 
 def update_head_mesh(settings, fb, head):
@@ -84,16 +87,55 @@ def render_frame():
     return w, h
 
 
+def _points_arr(points):
+    """ Float64 (..., 2) array and empty result of the same shape.
+    Float64 keeps array results equal to scalar python float ones """
+    points = np.asarray(points, dtype=np.float64)
+    return points, np.empty(points.shape, dtype=np.float64)
+
+
 def image_space_to_frame(x, y):
     """ Image centered Relative coords to Frame pixels """
     w, h = render_frame()
     return (x + 0.5) * w, y * w + 0.5 * h
 
 
+def image_space_to_frame_arr(points):
+    """ (..., 2) array version of image_space_to_frame """
+    w, h = render_frame()
+    points, res = _points_arr(points)
+    res[..., 0] = (points[..., 0] + 0.5) * w
+    res[..., 1] = points[..., 1] * w + 0.5 * h
+    return res
+
+
 def frame_to_image_space(x, y, w, h):
     return x / w - 0.5, (y - 0.5 * h) / w
 
 
+def frame_to_image_space_arr(points, w, h):
+    """ (..., 2) array version of frame_to_image_space """
+    points, res = _points_arr(points)
+    res[..., 0] = points[..., 0] / w - 0.5
+    res[..., 1] = (points[..., 1] - 0.5 * h) / w
+    return res
+
+
+def project_to_image_space(verts, obj_mat, camera_mat, projection, w, h):
+    """ (N, 3) object vertices to (N, 2) image space by one matrix multiply.
+    projection is builder projection matrix of camera keyframe """
+    # Object transform, inverse camera, projection apply -> numpy
+    transform = np.array(
+        obj_mat.transposed() @ camera_mat.inverted().transposed()) \
+        @ np.asarray(projection).T
+
+    # Fill matrix in homogeneous coords
+    vv = np.ones((len(verts), 4), dtype=np.float32)
+    vv[:, :-1] = verts
+    vv = vv @ transform
+    return frame_to_image_space_arr(vv[:, :2] / vv[:, 3:], w, h)
+
+
 def get_mouse_coords(event):
     return event.mouse_region_x, event.mouse_region_y
 
@@ -106,6 +148,15 @@ def image_space_to_region(x, y, x1, y1, x2, y2):
     return x1 + (x + 0.5) * sc, (y1 + y2) * 0.5 + y * sc
 
 
+def image_space_to_region_arr(points, x1, y1, x2, y2):
+    """ (..., 2) array version of image_space_to_region """
+    sc = x2 - x1
+    points, res = _points_arr(points)
+    res[..., 0] = x1 + (points[..., 0] + 0.5) * sc
+    res[..., 1] = (y1 + y2) * 0.5 + points[..., 1] * sc
+    return res
+
+
 def get_image_space_coord(px, py, context):
     x1, y1, x2, y2 = get_camera_border(context)
     x, y = region_to_image_space(px, py, x1, y1, x2, y2)
@@ -118,6 +169,15 @@ def region_to_image_space(x, y, x1, y1, x2, y2):
     return (x - (x1 + x2) * 0.5) / sc, (y - (y1 + y2) * 0.5) / sc
 
 
+def region_to_image_space_arr(points, x1, y1, x2, y2):
+    """ (..., 2) array version of region_to_image_space """
+    sc = (x2 - x1) if x2 != x1 else 1.0
+    points, res = _points_arr(points)
+    res[..., 0] = (points[..., 0] - (x1 + x2) * 0.5) / sc
+    res[..., 1] = (points[..., 1] - (y1 + y2) * 0.5) / sc
+    return res
+
+
 def pin_to_xyz(pin, headobj):
     """ Surface point from barycentric to XYZ """
     sp = pin.surface_point
@@ -144,6 +204,64 @@ def calc_model_mat(model_mat, head_mat):
         return None
 
 
+def inverse_transforms(mats, tolerance=Config.rigid_tolerance):
+    """ Inverse of (N, 4, 4) transform stack and mask of invertible ones.
+    Rigid transforms are inverted in closed form by one array operation,
+    others fall back to the general inverse """
+    mats = np.asarray(mats, dtype=np.float64)
+    # Translation may be stored in the last column or in the last row
+    row_major = np.abs(mats[:, 3] - (0., 0., 0., 1.)).max(axis=1) \
+        > np.abs(mats[:, :, 3] - (0., 0., 0., 1.)).max(axis=1)
+    affine = np.where(row_major[:, np.newaxis, np.newaxis],
+                      mats.transpose((0, 2, 1)), mats)
+
+    rot = affine[:, :3, :3]
+    rot_t = rot.transpose((0, 2, 1))
+    err = np.abs(rot_t @ rot - np.eye(3)).max(axis=(1, 2))
+    err = np.maximum(err, np.abs(affine[:, 3] - (0., 0., 0., 1.)).max(axis=1))
+    rigid = err < tolerance
+
+    res = np.zeros_like(affine)
+    res[:, :3, :3] = rot_t
+    res[:, :3, 3] = -np.einsum('nij,nj->ni', rot_t, affine[:, :3, 3])
+    res[:, 3, 3] = 1.0
+    res[row_major] = res[row_major].transpose((0, 2, 1))
+
+    valid = np.ones(len(mats), dtype=np.bool_)
+    general = np.flatnonzero(~rigid)
+    if len(general) == 0:
+        return res, valid
+    try:
+        res[general] = np.linalg.inv(mats[general])
+    except np.linalg.LinAlgError:
+        # Singular matrix in stack, so one by one
+        for i in general:
+            try:
+                res[i] = np.linalg.inv(mats[i])
+            except np.linalg.LinAlgError:
+                valid[i] = False
+    return res, valid
+
+
+def calc_model_mats(model_mats, head_mat):
+    """ Batched calc_model_mat for (N, 4, 4) stack of model matrices.
+    Returns camera matrices and mask of successfully computed ones """
+    rot_mat = np.array([
+        [1., 0., 0., 0.],
+        [0., 0., 1., 0.],
+        [0., -1., 0., 0.],
+        [0., 0., 0., 1.]])
+    head_mat = np.array(head_mat, dtype=np.float64)
+    model_mats = np.asarray(model_mats, dtype=np.float64).reshape((-1, 4, 4))
+    if np.linalg.det(head_mat) == 0.0:
+        return np.empty_like(model_mats), \
+               np.zeros(len(model_mats), dtype=np.bool_)
+    # inv(model @ rot @ inv(head)) == head @ rot.T @ inv(model)
+    inv_models, valid = inverse_transforms(model_mats)
+    ims = head_mat @ rot_mat.T @ inv_models
+    return ims.transpose((0, 2, 1)), valid
+
+
 def get_raw_camera_2d_data(context):
     """ Area coordinates and view parameters for debug logging """
     if bpy.app.background:
@@ -159,28 +277,15 @@ def get_raw_camera_2d_data(context):
     return res
 
 
-def get_camera_border(context):
-    """ Camera corners detection via context and parameters """
-    if bpy.app.background:
-        context = get_fake_context()
-
-    reg = context.region
-    w = reg.width
-    h = reg.height
-    rv3d = context.space_data.region_3d
-    z = rv3d.view_camera_zoom
+def calc_camera_border(w, h, z, off_x, off_y, rx, ry):
+    """ Camera corners in region by its size, view zoom and offset """
     # Blender Zoom formula
     f = (z * 0.01 + math.sqrt(0.5)) ** 2  # f - scale factor
 
-    scene = context.scene
-    rx = scene.render.resolution_x
-    ry = scene.render.resolution_y
-
     a1 = w / h
     a2 = rx / ry
 
-    offset = (rv3d.view_camera_offset[0] * w * 2 * f,
-              rv3d.view_camera_offset[1] * h * 2 * f)
+    offset = (off_x * w * 2 * f, off_y * h * 2 * f)
 
     # This works when Camera Sensor Mode is Auto
     if a1 >= 1.0:
@@ -208,6 +313,73 @@ def get_camera_border(context):
     return x1, y1, x2, y2
 
 
+class FBCameraBorder:
+    """ Camera corners shared by all modal handlers.
+    Version changes only when the returned border changes,
+    so 2D batches built for the same version can be reused """
+    _borders = {}
+    _last = None
+    _version = 0
+    _hits = 0
+    _misses = 0
+
+    @staticmethod
+    def make_key(context):
+        reg = context.region
+        rv3d = context.space_data.region_3d
+        render = context.scene.render
+        off = rv3d.view_camera_offset
+        return (reg.width, reg.height, rv3d.view_camera_zoom,
+                off[0], off[1], render.resolution_x, render.resolution_y)
+
+    @classmethod
+    def get(cls, context):
+        key = cls.make_key(context)
+        border = cls._borders.get(key)
+        if border is None:
+            cls._misses += 1
+            if len(cls._borders) >= Config.camera_border_cache_size:
+                cls._borders = {}
+            border = calc_camera_border(*key)
+            cls._borders[key] = border
+        else:
+            cls._hits += 1
+        if border != cls._last:
+            cls._last = border
+            cls._version += 1
+        return border
+
+    @classmethod
+    def version(cls):
+        return cls._version
+
+    @classmethod
+    def invalidate(cls):
+        cls._borders = {}
+        cls._last = None
+        cls._version += 1
+
+    @classmethod
+    def hits(cls):
+        return cls._hits
+
+    @classmethod
+    def misses(cls):
+        return cls._misses
+
+    @classmethod
+    def reset_counters(cls):
+        cls._hits = 0
+        cls._misses = 0
+
+
+def get_camera_border(context):
+    """ Camera corners detection via context and parameters """
+    if bpy.app.background:
+        context = get_fake_context()
+    return FBCameraBorder.get(context)
+
+
 def is_safe_region(context, x, y):
     """ Safe region for pin operation """
     if bpy.app.background:
@@ -23,7 +23,24 @@ import bgl
 from gpu_extras.batch import batch_for_shader
 from . shaders import simple_fill_vertex_shader, \
     black_fill_fragment_shader, residual_vertex_shader, \
-    residual_fragment_shader
+    residual_fragment_shader, wireframe_vertex_shader, \
+    wireframe_fragment_shader
+
+
+def edges_mask(edges, pairs):
+    """ Boolean mask of (N, 2) edges found in pairs of any orientation """
+    edges = np.asarray(edges).reshape((-1, 2))
+    pairs = np.asarray(pairs).reshape((-1, 2))
+    if len(edges) == 0 or len(pairs) == 0:
+        return np.zeros(len(edges), dtype=np.bool_)
+    # Sorted pair is encoded in a single int64 value
+    n = int(max(edges.max(), pairs.max())) + 1
+
+    def _codes(arr):
+        arr = np.sort(arr, axis=1).astype(np.int64)
+        return arr[:, 0] * n + arr[:, 1]
+
+    return np.isin(_codes(edges), _codes(pairs))
 
 
 class FBEdgeShaderBase:
@@ -54,8 +71,6 @@ class FBEdgeShaderBase:
         self.indices = []
         # Edge vertices
         self.edges_vertices = []
-        self.edges_indices = []
-        self.edges_colors = []
         self.vertices_colors = []
         # Check if blender started in background mode
         if not bpy.app.background:
@@ -64,17 +79,6 @@ class FBEdgeShaderBase:
     def is_working(self):
         return not (self.draw_handler is None)
 
-    def init_color_data(self, color=(0.5, 0.0, 0.7, 0.2)):
-        self.edges_colors = np.full(
-            (len(self.edges_vertices), 4), color).tolist()
-
-    def init_special_areas(self, mesh, pairs, color=(0.5, 0.0, 0.7, 0.2)):
-        for i, edge in enumerate(mesh.edges):
-            vv = edge.vertices
-            if ((vv[0], vv[1]) in pairs) or ((vv[1], vv[0]) in pairs):
-                self.edges_colors[i * 2] = color
-                self.edges_colors[i * 2 + 1] = color
-
     def register_handler(self, args):
         if self.draw_handler is not None:
             self.unregister_handler()
@@ -161,13 +165,69 @@ class FBEdgeShader2D(FBEdgeShaderBase):
 
 
 class FBEdgeShader3D(FBEdgeShaderBase):
-    """ Wireframe drawing class """
+    """ Wireframe drawing class.
+    GPU buffers and batches are kept between updates while topology is
+    same, so only changed positions are refilled.
+    Mesh topology is also read only once while it is not changed.
+    Colors and opacity are shader uniforms, so they cost no uploads """
+    def __init__(self):
+        self.fill_indices_buf = None
+        self.edges_special_buf = None
+        self.fill_pos_buf = None
+        self.line_pos_buf = None
+        self._fill_verts = None
+        self._batches_signature = None
+        self._fill_indices = None
+        self._edges_special = None
+        self._special_mask = None
+        # Special face part flag for both vertices of every edge
+        self.edges_special = np.empty(0, dtype=np.uint8)
+        self.color = (0.5, 0.0, 0.7)
+        self.special_color = (0.5, 0.0, 0.7)
+        self.opacity = 0.2
+        self.upload_bytes = 0  # GPU upload volume of the last update
+        self._edges = np.empty(0, 'i')
+        self._mask_key = None
+        self._topology_signature = None
+        self.topology_builds = 0
+        self._special_masks = {}
+        super().__init__()
+
+    def set_colors(self, color, special_color, opacity):
+        """ Uniforms only, no buffers are rebuilt """
+        self.color = tuple(color)
+        self.special_color = tuple(special_color)
+        self.opacity = opacity
+
+    def init_special_areas(self, mesh, pairs):
+        mask = self.special_edges(mesh, pairs)
+        if mask is not self._special_mask:
+            self.edges_special = np.repeat(mask, 2).astype(np.uint8)
+            self._special_mask = mask
+
+    def special_edges(self, mesh, pairs):
+        """ Edge mask is cached per pairs object and mesh topology.
+        Pairs are expected to be kept by caller like in
+        FBViewport.get_special_indices """
+        if self.topology_signature(mesh) != self._topology_signature:
+            self._init_topology(mesh)
+        cached = self._special_masks.get(id(pairs))
+        if cached is not None and cached[0] is pairs:
+            return cached[1]
+        mask = edges_mask(self._edges, pairs)
+        mask.flags.writeable = False
+        self._special_masks[id(pairs)] = (pairs, mask)
+        return mask
+
     def draw_callback(self, op, context):
         # Force Stop
         if self.is_handler_list_empty():
             self.unregister_handler()
             return
 
+        if self.fill_batch is None or self.line_batch is None:
+            return
+
         bgl.glEnable(bgl.GL_BLEND)
         bgl.glEnable(bgl.GL_LINE_SMOOTH)
         bgl.glHint(bgl.GL_LINE_SMOOTH_HINT, bgl.GL_NICEST)
@@ -188,64 +248,149 @@ class FBEdgeShader3D(FBEdgeShaderBase):
         bgl.glDepthMask(bgl.GL_FALSE)
         bgl.glPolygonMode(bgl.GL_FRONT_AND_BACK, bgl.GL_LINE)
 
+        self.line_shader.bind()
+        self.line_shader.uniform_float('mainColor', self.color)
+        self.line_shader.uniform_float('specialColor', self.special_color)
+        self.line_shader.uniform_float('opacity', self.opacity)
         self.line_batch.draw(self.line_shader)
 
         bgl.glPolygonMode(bgl.GL_FRONT_AND_BACK, bgl.GL_FILL)
         bgl.glDepthMask(bgl.GL_TRUE)
         bgl.glDisable(bgl.GL_DEPTH_TEST)
 
+    @staticmethod
+    def _vertex_buffer(name, arr, comp_type='F32', fetch_mode='FLOAT'):
+        """ GPU vertex buffer with one attribute from (N, K) or (N,) array """
+        fmt = gpu.types.GPUVertFormat()
+        fmt.attr_add(id=name, comp_type=comp_type,
+                     len=1 if arr.ndim == 1 else arr.shape[1],
+                     fetch_mode=fetch_mode)
+        buf = gpu.types.GPUVertBuf(len=len(arr), format=fmt)
+        buf.attr_fill(name, arr)
+        return buf
+
+    def _update_fill_indices(self):
+        """ True if triangles differ from the uploaded ones """
+        indices = np.ascontiguousarray(self.indices, dtype=np.int32)
+        if self.fill_indices_buf is not None and (
+                indices is self._fill_indices or
+                np.array_equal(indices, self._fill_indices)):
+            return False
+        self.fill_indices_buf = gpu.types.GPUIndexBuf(type='TRIS', seq=indices)
+        self._fill_indices = indices
+        self.upload_bytes += indices.nbytes
+        return True
+
+    def _update_edges_special(self):
+        if self.edges_special_buf is not None and (
+                self.edges_special is self._edges_special or
+                np.array_equal(self.edges_special, self._edges_special)):
+            return False
+        flags = np.ascontiguousarray(self.edges_special, dtype=np.uint8)
+        self.edges_special_buf = self._vertex_buffer(
+            'special', flags, comp_type='U8', fetch_mode='INT_TO_FLOAT')
+        self._edges_special = self.edges_special
+        self.upload_bytes += flags.nbytes
+        return True
+
     def create_batches(self):
         if bpy.app.background:
             return
-        self.fill_batch = batch_for_shader(
-                    self.fill_shader, 'TRIS',
-                    {"pos": self.vertices},
-                    indices=self.indices,
-                )
-
-        # Our shader batch
-        self.line_batch = batch_for_shader(
-            self.line_shader, 'LINES',
-            {"pos": self.edges_vertices, "color": self.edges_colors},
-            indices=self.edges_indices)
+        self.upload_bytes = 0
+        verts = np.ascontiguousarray(self.vertices, dtype=np.float32)
+        edges_verts = np.ascontiguousarray(self.edges_vertices,
+                                           dtype=np.float32)
+        if len(verts) == 0:
+            self.fill_batch = None
+            self.line_batch = None
+            self._fill_verts = None
+            return
+        if len(edges_verts) != len(self.edges_special):
+            # Special parts are unknown for this mesh yet
+            self.edges_special = np.zeros(len(edges_verts), dtype=np.uint8)
+            self._special_mask = None
+
+        indices_changed = self._update_fill_indices()
+        # Every edge has its own pair of vertices, so no index buffer
+        special_changed = self._update_edges_special()
+        if not indices_changed and not special_changed and \
+                self.fill_batch is not None and \
+                self.line_batch is not None and \
+                self._batches_signature == self._topology_signature:
+            if np.array_equal(verts, self._fill_verts):
+                return
+            if self._refill(self.fill_pos_buf, verts) and \
+                    self._refill(self.line_pos_buf, edges_verts):
+                self._fill_verts = verts
+                self.upload_bytes += verts.nbytes + edges_verts.nbytes
+                return
+
+        self.fill_pos_buf = self._vertex_buffer('pos', verts)
+        self.fill_batch = gpu.types.GPUBatch(
+            type='TRIS', buf=self.fill_pos_buf, elem=self.fill_indices_buf)
+        self.line_pos_buf = self._vertex_buffer('pos', edges_verts)
+        self.line_batch = gpu.types.GPUBatch(
+            type='LINES', buf=self.line_pos_buf)
+        self.line_batch.vertbuf_add(self.edges_special_buf)
+        self._batches_signature = self._topology_signature
+        self._fill_verts = verts
+        self.upload_bytes += verts.nbytes + edges_verts.nbytes
+
+    @staticmethod
+    def _refill(buf, arr):
+        """ True if kept position buffer is refilled in place """
+        try:
+            buf.attr_fill('pos', arr)
+        except ValueError:
+            # Blender 2.8x can't refill static buffer once it was drawn
+            return False
+        return True
 
     def init_shaders(self):
         self.fill_shader = gpu.types.GPUShader(
             simple_fill_vertex_shader(), black_fill_fragment_shader())
 
-        self.line_shader = gpu.shader.from_builtin('3D_SMOOTH_COLOR')
+        self.line_shader = gpu.types.GPUShader(
+            wireframe_vertex_shader(), wireframe_fragment_shader())
 
-    def init_geom_data(self, obj):
-        mesh = obj.data
-        mesh.calc_loop_triangles()
+    def topology_signature(self, mesh):
+        return (mesh.as_pointer(), len(mesh.vertices), len(mesh.edges),
+                len(mesh.polygons), self._mask_key)
 
-        verts = np.empty((len(mesh.vertices), 3), 'f')
-        indices = np.empty((len(mesh.loop_triangles), 3), 'i')
+    def invalidate_topology(self):
+        self._topology_signature = None
+        self._special_masks = {}
 
-        mesh.vertices.foreach_get(
-            "co", np.reshape(verts, len(mesh.vertices) * 3))
-        mesh.loop_triangles.foreach_get(
-            "vertices", np.reshape(indices, len(mesh.loop_triangles) * 3))
+    def _init_topology(self, mesh):
+        """ Triangle and edge indices are same for the whole pinmode
+        session, so they are read only when mesh topology changes """
+        mesh.calc_loop_triangles()
+        indices = np.empty((len(mesh.loop_triangles), 3), 'i')
+        mesh.loop_triangles.foreach_get("vertices", indices.ravel())
 
-        # Object matrix usage
-        m = np.array(obj.matrix_world, dtype=np.float32).transpose()
-        vv = np.ones((len(mesh.vertices), 4), dtype=np.float32)
-        vv[:, :-1] = verts
-        vv = vv @ m
-        # Transformed vertices
-        verts = vv[:, :3]
+        edges = np.empty((len(mesh.edges), 2), 'i')
+        mesh.edges.foreach_get("vertices", edges.ravel())
+        self._edges = edges.ravel()
+        self._special_masks = {}
 
-        self.vertices = verts
         self.indices = indices
+        self._topology_signature = self.topology_signature(mesh)
+        self.topology_builds += 1
 
-        edges = np.empty((len(mesh.edges), 2), 'i')
-        mesh.edges.foreach_get(
-            "vertices", np.reshape(edges, len(mesh.edges) * 2))
+    def init_geom_data(self, obj, mask_key=None):
+        """ mask_key is (masks, uv set) of the head when they are changed,
+        None keeps the previous one """
+        mesh = obj.data
+        if mask_key is not None:
+            self._mask_key = mask_key
+        if self.topology_signature(mesh) != self._topology_signature:
+            self._init_topology(mesh)
 
-        self.edges_vertices = self.vertices[edges.ravel()]
-        # self.init_edge_indices(obj)
+        verts = np.empty((len(mesh.vertices), 3), 'f')
+        mesh.vertices.foreach_get("co", verts.ravel())
 
-    # Separated to
-    def init_edge_indices(self, obj):
-        self.edges_indices = np.arange(len(self.edges_vertices) * 2).reshape(
-            len(self.edges_vertices), 2).tolist()
+        # Object matrix usage
+        m = np.array(obj.matrix_world, dtype=np.float32)
+        # Transformed vertices
+        self.vertices = verts @ m[:3, :3].T + m[:3, 3]
+        self.edges_vertices = self.vertices[self._edges]
@@ -0,0 +1,281 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+# KeenTools for blender is a blender addon for using KeenTools in Blender.
+# Copyright (C) 2019  KeenTools
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+import json
+import logging
+import os
+import struct
+import zlib
+
+import bpy
+import numpy as np
+
+from ..config import Config, get_main_settings
+from ..fbloader import FBLoader
+from .meshes import loop_starts
+
+
+# Exported coords are builder ones (Y-up), the same as in OBJ and glTF
+def split_vertices_by_uvs(verts, face_indices, uvs):
+    """ Vertices are duplicated on UV seams for per-vertex UV formats.
+    Returns new verts, per-vertex uvs and new index of every loop """
+    keys = np.empty((len(face_indices), 3), dtype=np.int32)
+    keys[:, 0] = face_indices
+    keys[:, 1:] = np.ascontiguousarray(uvs, dtype=np.float32).view(np.int32)
+    _, first, inverse = np.unique(keys, axis=0, return_index=True,
+                                  return_inverse=True)
+    return (verts[face_indices[first]], uvs[first],
+            inverse.reshape(-1).astype(np.uint32))
+
+
+def triangulate(face_sizes, loop_indices):
+    """ Fan triangulation of polygons, (T, 3) array of loop_indices """
+    starts = loop_starts(face_sizes)
+    tri_counts = face_sizes - 2
+    tri_starts = np.repeat(starts, tri_counts)
+    tri_offsets = np.arange(tri_counts.sum()) - np.repeat(
+        np.cumsum(tri_counts) - tri_counts, tri_counts)
+    tris = np.stack([tri_starts, tri_starts + tri_offsets + 1,
+                     tri_starts + tri_offsets + 2], axis=1)
+    return loop_indices[tris]
+
+
+def encode_png(img):
+    """ RGBA float image with bottom-up rows as in Blender """
+    h, w = img.shape[:2]
+    rgba = (np.clip(img[::-1], 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)
+    raw = np.zeros((h, w * 4 + 1), dtype=np.uint8)  # filter byte per row
+    raw[:, 1:] = rgba.reshape((h, w * 4))
+
+    def _chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + \
+               struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    return b'\x89PNG\r\n\x1a\n' + \
+        _chunk(b'IHDR', struct.pack('>IIBBBBB', w, h, 8, 6, 0, 0, 0)) + \
+        _chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)) + \
+        _chunk(b'IEND', b'')
+
+
+def write_png(filepath, img):
+    with open(filepath, 'wb') as f:
+        f.write(encode_png(img))
+
+
+def write_obj(filepath, verts, face_sizes, face_indices, uvs=None,
+              texture=None):
+    """ Texture is saved as PNG next to OBJ and referenced by MTL """
+    base = os.path.splitext(filepath)[0]
+    name = os.path.basename(base)
+    lines = ['# {}\n'.format(Config.addon_full_name)]
+    if texture is not None:
+        write_png(base + '.png', texture)
+        with open(base + '.mtl', 'w') as f:
+            f.write('newmtl {0}\nKd 1 1 1\nmap_Kd {0}.png\n'.format(name))
+        lines.append('mtllib {}.mtl\nusemtl {}\n'.format(name, name))
+
+    lines.append(('v %.6f %.6f %.6f\n' * len(verts)) %
+                 tuple(verts.ravel().tolist()))
+
+    max_size = int(face_sizes.max()) if len(face_sizes) > 0 else 0
+    if uvs is not None:
+        unique_uvs, uv_indices = np.unique(uvs, axis=0, return_inverse=True)
+        lines.append(('vt %.6f %.6f\n' * len(unique_uvs)) %
+                     tuple(unique_uvs.ravel().tolist()))
+        values = np.empty((len(face_indices), 2), dtype=np.int64)
+        values[:, 0] = face_indices + 1
+        values[:, 1] = uv_indices.reshape(-1) + 1
+        formats = ['f' + ' %d/%d' * k + '\n' for k in range(max_size + 1)]
+    else:
+        values = face_indices.astype(np.int64) + 1
+        formats = ['f' + ' %d' * k + '\n' for k in range(max_size + 1)]
+    lines.append(''.join(np.array(formats)[face_sizes]) %
+                 tuple(values.ravel().tolist()))
+
+    with open(filepath, 'w') as f:
+        f.writelines(lines)
+
+
+def _ply_face_bytes(face_sizes, loop_indices):
+    """ Binary PLY face list: uchar count and int32 indices per face """
+    f_count = len(face_sizes)
+    l_count = len(loop_indices)
+    starts = loop_starts(face_sizes)
+    face_pos = np.arange(f_count) + 4 * starts
+    data = np.empty(f_count + 4 * l_count, dtype=np.uint8)
+    data[face_pos] = face_sizes
+    loop_pos = np.repeat(face_pos + 1 - 4 * starts, face_sizes) + \
+        4 * np.arange(l_count)
+    data[(loop_pos[:, np.newaxis] + np.arange(4)).ravel()] = \
+        loop_indices.astype('<i4').view(np.uint8)
+    return data.tobytes()
+
+
+def write_ply(filepath, verts, face_sizes, face_indices, uvs=None,
+              texture_file=None):
+    """ texture_file is linked in header like map_Kd in OBJ material """
+    if uvs is not None:
+        verts, uvs, face_indices = split_vertices_by_uvs(
+            verts, face_indices, uvs)
+        vertex_data = np.empty((len(verts), 5), dtype='<f4')
+        vertex_data[:, :3] = verts
+        vertex_data[:, 3:] = uvs
+        uv_header = 'property float s\nproperty float t\n'
+    else:
+        vertex_data = np.asarray(verts, dtype='<f4')
+        uv_header = ''
+    texture_header = '' if texture_file is None else \
+        'comment TextureFile {}\n'.format(texture_file)
+
+    header = 'ply\nformat binary_little_endian 1.0\n' \
+             'comment {}\n' \
+             '{}' \
+             'element vertex {}\n' \
+             'property float x\nproperty float y\nproperty float z\n' \
+             '{}' \
+             'element face {}\n' \
+             'property list uchar int vertex_indices\n' \
+             'end_header\n'.format(Config.addon_full_name, texture_header,
+                                   len(verts), uv_header, len(face_sizes))
+    with open(filepath, 'wb') as f:
+        f.write(header.encode('utf-8'))
+        f.write(vertex_data.tobytes())
+        f.write(_ply_face_bytes(face_sizes, face_indices))
+
+
+def encode_glb(verts, face_sizes, face_indices, uvs=None, texture=None):
+    if uvs is not None:
+        verts, uvs, face_indices = split_vertices_by_uvs(
+            verts, face_indices, uvs)
+    positions = np.ascontiguousarray(verts, dtype='<f4')
+    indices = triangulate(face_sizes, face_indices).astype('<u4')
+
+    chunks = []
+    buffer_views = []
+    offset = 0
+
+    def _add_view(data, target=None):
+        nonlocal offset
+        view = {'buffer': 0, 'byteOffset': offset, 'byteLength': len(data)}
+        if target is not None:
+            view['target'] = target
+        buffer_views.append(view)
+        padding = b'\0' * (-len(data) % 4)
+        chunks.append(data + padding)
+        offset += len(data) + len(padding)
+        return len(buffer_views) - 1
+
+    accessors = [
+        {'bufferView': _add_view(positions.tobytes(), 34962),
+         'componentType': 5126, 'count': len(positions), 'type': 'VEC3',
+         'min': positions.min(axis=0).tolist(),
+         'max': positions.max(axis=0).tolist()},
+        {'bufferView': _add_view(indices.tobytes(), 34963),
+         'componentType': 5125, 'count': indices.size, 'type': 'SCALAR'}]
+    primitive = {'attributes': {'POSITION': 0}, 'indices': 1}
+    gltf = {'asset': {'version': '2.0',
+                      'generator': Config.addon_full_name},
+            'scene': 0, 'scenes': [{'nodes': [0]}],
+            'nodes': [{'mesh': 0}],
+            'meshes': [{'primitives': [primitive]}],
+            'accessors': accessors, 'bufferViews': buffer_views}
+
+    if uvs is not None:
+        texcoords = np.empty((len(uvs), 2), dtype='<f4')
+        texcoords[:, 0] = uvs[:, 0]
+        texcoords[:, 1] = 1.0 - uvs[:, 1]  # glTF UV origin is top left
+        accessors.append(
+            {'bufferView': _add_view(texcoords.tobytes(), 34962),
+             'componentType': 5126, 'count': len(texcoords),
+             'type': 'VEC2'})
+        primitive['attributes']['TEXCOORD_0'] = len(accessors) - 1
+
+    if texture is not None:
+        gltf['images'] = [{'bufferView': _add_view(encode_png(texture)),
+                           'mimeType': 'image/png'}]
+        gltf['textures'] = [{'source': 0}]
+        gltf['materials'] = [{'pbrMetallicRoughness': {
+            'baseColorTexture': {'index': 0}, 'metallicFactor': 0.0}}]
+        primitive['material'] = 0
+
+    bin_chunk = b''.join(chunks)
+    gltf['buffers'] = [{'byteLength': len(bin_chunk)}]
+    json_chunk = json.dumps(gltf, separators=(',', ':')).encode('utf-8')
+    json_chunk += b' ' * (-len(json_chunk) % 4)
+
+    length = 12 + 8 + len(json_chunk) + 8 + len(bin_chunk)
+    return struct.pack('<4sII', b'glTF', 2, length) + \
+        struct.pack('<I4s', len(json_chunk), b'JSON') + json_chunk + \
+        struct.pack('<I4s', len(bin_chunk), b'BIN\0') + bin_chunk
+
+
+def write_glb(filepath, verts, face_sizes, face_indices, uvs=None,
+              texture=None):
+    with open(filepath, 'wb') as f:
+        f.write(encode_glb(verts, face_sizes, face_indices, uvs, texture))
+
+
+def export_arrays(filepath, verts, face_sizes, face_indices, uvs=None,
+                  texture=None):
+    """ File format is selected by extension: .obj, .ply or .glb """
+    ext = os.path.splitext(filepath)[1].lower()
+    if ext == '.obj':
+        write_obj(filepath, verts, face_sizes, face_indices, uvs, texture)
+    elif ext == '.ply':
+        base = os.path.splitext(filepath)[0]
+        texture_file = None
+        if texture is not None:
+            texture_file = os.path.basename(base) + '.png'
+            write_png(base + '.png', texture)
+        write_ply(filepath, verts, face_sizes, face_indices, uvs,
+                  texture_file)
+    elif ext == '.glb':
+        write_glb(filepath, verts, face_sizes, face_indices, uvs, texture)
+    else:
+        raise ValueError('Unsupported export file format: {}'.format(ext))
+
+
+def get_texture_array(tex_name=Config.tex_builder_filename):
+    """ Baked texture as (h, w, 4) float array or None """
+    tex = bpy.data.images.get(tex_name)
+    if tex is None or tex.size[0] == 0 or tex.size[1] == 0:
+        return None
+    w, h = tex.size[:2]
+    pixels = np.empty(w * h * 4, dtype=np.float32)
+    try:
+        tex.pixels.foreach_get(pixels)  # Blender 2.83+
+    except AttributeError:
+        pixels[:] = tex.pixels[:]
+    return pixels.reshape((h, w, 4))
+
+
+def export_head(headnum, filepath, use_texture=True, keyframe=None):
+    """ Head geometry straight from builder, Blender mesh is not used.
+    Works in background mode too """
+    logger = logging.getLogger(__name__)
+    settings = get_main_settings()
+    head = settings.get_head(headnum)
+    if head is None or not FBLoader.load_model(headnum):
+        return False
+
+    verts, face_sizes, face_indices, uvs = FBLoader.get_builder_arrays(
+        FBLoader.get_builder(), head.get_masks(), head.tex_uv_shape,
+        keyframe, builder_version=head.mod_ver)
+    texture = get_texture_array() if use_texture else None
+    export_arrays(filepath, verts, face_sizes, face_indices, uvs, texture)
+    logger.debug('HEAD EXPORTED: {}'.format(filepath))
+    return True
@@ -0,0 +1,117 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+# KeenTools for blender is a blender addon for using KeenTools in Blender.
+# Copyright (C) 2019  KeenTools
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+
+from collections import OrderedDict
+
+from ..config import Config
+from .meshes import builder_to_blender_coords
+
+
+class FBExpressionCache:
+    """ Builder vertices in Blender coords for current builder state.
+    Neutral vertices are stored with None keyframe. Least recently used
+    arrays are evicted when total size exceeds the limit.
+    Returned arrays are valid until the cache invalidation,
+    after that their memory is reused for new builder states """
+    _vertices = OrderedDict()
+    _pool = []
+    _max_pool_size = 2
+    _bytes = 0
+    _max_bytes = Config.expression_cache_max_bytes
+    _serial = None
+    _hits = 0
+    _misses = 0
+
+    @classmethod
+    def get_vertices(cls, fb, keyframe=None):
+        verts = cls._vertices.get(keyframe)
+        if verts is not None:
+            cls._vertices.move_to_end(keyframe)
+            cls._hits += 1
+            return verts
+        cls._misses += 1
+
+        if keyframe is None:
+            geom = fb.applied_args_vertices()
+        else:
+            geom = fb.applied_args_model_vertices_at(keyframe)
+        verts = builder_to_blender_coords(geom, out=cls._from_pool(len(geom)))
+        verts.flags.writeable = False
+        cls._vertices[keyframe] = verts
+        cls._bytes += verts.nbytes
+        while cls._bytes > cls._max_bytes and len(cls._vertices) > 1:
+            _, old = cls._vertices.popitem(last=False)
+            cls._bytes -= old.nbytes
+        return verts
+
+    @classmethod
+    def _from_pool(cls, v_count):
+        for i, arr in enumerate(cls._pool):
+            if len(arr) == v_count:
+                return cls._pool.pop(i)
+        return None
+
+    @classmethod
+    def _to_pool(cls, arr):
+        if len(cls._pool) < cls._max_pool_size:
+            arr.flags.writeable = True
+            cls._pool.append(arr)
+
+    @classmethod
+    def invalidate(cls):
+        """ Any change of builder state affecting all keyframes """
+        for verts in cls._vertices.values():
+            cls._to_pool(verts)
+        cls._vertices = OrderedDict()
+        cls._bytes = 0
+        cls._serial = None
+
+    @classmethod
+    def invalidate_keyframe(cls, keyframe):
+        verts = cls._vertices.pop(keyframe, None)
+        if verts is not None:
+            cls._bytes -= verts.nbytes
+        cls._serial = None
+
+    @classmethod
+    def on_deserialize(cls, serial_str):
+        """ Deserialization of the same state keeps cached vertices """
+        if serial_str != cls._serial:
+            cls.invalidate()
+            cls._serial = serial_str
+
+    @classmethod
+    def set_max_bytes(cls, max_bytes):
+        cls._max_bytes = max_bytes
+
+    @classmethod
+    def cached_bytes(cls):
+        return cls._bytes
+
+    @classmethod
+    def hits(cls):
+        return cls._hits
+
+    @classmethod
+    def misses(cls):
+        return cls._misses
+
+    @classmethod
+    def reset_counters(cls):
+        cls._hits = 0
+        cls._misses = 0
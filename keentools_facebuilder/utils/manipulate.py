@@ -24,7 +24,7 @@ import bpy
 from ..fbloader import FBLoader
 from ..config import (Config, get_main_settings, get_operators,
                       ErrorType, BuilderType)
-from . import cameras, attrs, coords
+from . import cameras, attrs, coords, meshes
 from .exif_reader import (read_exif_to_camera, auto_setup_camera_from_exif,
                           update_image_groups)
 
@@ -118,6 +118,83 @@ def push_neutral_head_in_undo_history(head, keyframe,
         coords.update_head_mesh_emotions(fb, head.headobj, keyframe)
 
 
+def _set_shape_key_vertices(obj, name, verts):
+    key_block = None
+    if obj.data.shape_keys is not None:
+        key_block = obj.data.shape_keys.key_blocks.get(name)
+    if key_block is None:
+        key_block = obj.shape_key_add(name=name, from_mix=False)
+    key_block.data.foreach_set('co', verts.ravel())
+    return key_block
+
+
+def expression_shape_key_name(camera, camnum):
+    if camera.camobj is not None:
+        return camera.camobj.name
+    return '{}{}'.format(Config.expression_shape_key_prefix, camnum)
+
+
+def expressions_object(obj):
+    """ Copy of head object for shape keys. Head mesh itself is refilled
+    and updated by the addon, shape keys would break it """
+    name = obj.name + Config.expressions_object_suffix
+    copy = bpy.data.objects.get(name)
+    if copy is not None and copy.type == 'MESH' and \
+            len(copy.data.vertices) == len(obj.data.vertices):
+        return copy
+
+    mesh = obj.data.copy()
+    meshes.FBMeshGeomUpdater.forget(mesh)
+    mesh.name = name
+    if copy is None:
+        copy = bpy.data.objects.new(name, mesh)
+        for col in obj.users_collection:
+            col.objects.link(copy)
+    else:
+        old_mesh = copy.data
+        copy.data = mesh
+        if old_mesh.users == 0:
+            meshes.FBMeshGeomUpdater.forget(old_mesh)
+            bpy.data.meshes.remove(old_mesh)
+    copy.matrix_world = obj.matrix_world.copy()
+    return copy
+
+
+def export_expressions_to_shape_keys(headnum, progress_callback=None):
+    """ Neutral head as basis and every view expression as shape key
+    of the head copy. Returns number of exported expressions or -1 """
+    logger = logging.getLogger(__name__)
+    settings = get_main_settings()
+    head = settings.get_head(headnum)
+    if head is None or not FBLoader.load_model(headnum):
+        return -1
+    fb = FBLoader.get_builder()
+    obj = expressions_object(head.headobj)
+
+    neutral = meshes.builder_to_blender_coords(fb.applied_args_vertices())
+    if len(neutral) != len(obj.data.vertices):
+        logger.error('SHAPE KEYS VERTEX COUNT MISMATCH: {} {}'.format(
+            len(neutral), len(obj.data.vertices)))
+        return -1
+    _set_shape_key_vertices(obj, Config.neutral_shape_key_name, neutral)
+
+    count = 0
+    for camnum, camera in enumerate(head.cameras):
+        kid = camera.get_keyframe()
+        if fb.is_key_at(kid):
+            verts = meshes.builder_to_blender_coords(
+                fb.applied_args_model_vertices_at(kid))
+            _set_shape_key_vertices(
+                obj, expression_shape_key_name(camera, camnum), verts)
+            count += 1
+        if progress_callback is not None:
+            progress_callback(camnum + 1)
+
+    obj.data.update()
+    logger.debug('EXPRESSIONS EXPORTED AS SHAPE KEYS: {}'.format(count))
+    return count
+
+
 def check_settings():
     settings = get_main_settings()
     if not settings.check_heads_and_cams():
@@ -298,7 +375,7 @@ def reconstruct_by_head():
         scene.render.resolution_x = params['frame_width']
         scene.render.resolution_y = params['frame_height']
 
-        fb.deserialize(head.get_serial_str())
+        FBLoader.deserialize(head.get_serial_str())
         logger.debug("RECONSTRUCT KEYFRAMES {}".format(str(fb.keyframes())))
 
         for i, kid in enumerate(fb.keyframes()):
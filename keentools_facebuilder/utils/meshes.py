@@ -0,0 +1,397 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+# KeenTools for blender is a blender addon for using KeenTools in Blender.
+# Copyright (C) 2019  KeenTools
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+
+import numpy as np
+import bpy
+from bpy.app.handlers import persistent
+
+from ..config import Config
+
+
+def builder_to_blender_coords(verts, out=None):
+    """ Builder Y-up coords to Blender Z-up coords.
+    Axis swap (x, y, z) -> (x, -z, y) without matrix multiplication """
+    verts = np.asarray(verts)
+    if out is None:
+        out = np.empty((len(verts), 3), dtype=np.float32)
+    out[:, 0] = verts[:, 0]
+    np.negative(verts[:, 2], out=out[:, 1])
+    out[:, 2] = verts[:, 1]
+    return out
+
+
+def get_mesh_faces(me):
+    """ Face sizes and flat face vertex indices of builder mesh """
+    f_count = me.faces_count()
+    face_sizes = np.fromiter((me.face_size(i) for i in range(f_count)),
+                             dtype=np.int32, count=f_count)
+    face_indices = np.fromiter(
+        (me.face_point(i, j)
+         for i in range(f_count) for j in range(face_sizes[i])),
+        dtype=np.int32, count=int(face_sizes.sum()))
+    return face_sizes, face_indices
+
+
+def get_mesh_uvs(me):
+    """ Per-loop UV coords of builder mesh as (N, 2) array """
+    uvs_count = me.uvs_count()
+    uvs = np.fromiter((c for i in range(uvs_count) for c in me.uv(i)),
+                      dtype=np.float32, count=uvs_count * 2)
+    return uvs.reshape((uvs_count, 2))
+
+
+def get_mesh_normals(me, corner_vertices):
+    """ Per-vertex normals averaged from builder per-corner normals """
+    f_count = me.faces_count()
+    corners = np.fromiter(
+        (c for i in range(f_count) for j in range(me.face_size(i))
+         for c in me.normal(i, j)),
+        dtype=np.float32, count=len(corner_vertices) * 3).reshape((-1, 3))
+    normals = np.zeros((me.points_count(), 3), dtype=np.float32)
+    np.add.at(normals, corner_vertices, corners)
+    lengths = np.linalg.norm(normals, axis=1)
+    lengths[lengths == 0] = 1.0
+    normals /= lengths[:, np.newaxis]
+    return normals
+
+
+def loop_starts(face_sizes):
+    starts = np.zeros(len(face_sizes), dtype=np.int32)
+    np.cumsum(face_sizes[:-1], out=starts[1:])
+    return starts
+
+
+def face_tuples(face_sizes, face_indices):
+    return [tuple(f) for f in
+            np.split(face_indices, loop_starts(face_sizes)[1:])]
+
+
+def missing_faces(full_sizes, full_indices, face_sizes, face_indices):
+    """ Boolean mask of full topology faces absent in the other one """
+    present = set(face_tuples(face_sizes, face_indices))
+    return np.fromiter((f not in present for f in
+                        face_tuples(full_sizes, full_indices)),
+                       dtype=np.bool_, count=len(full_sizes))
+
+
+def faces_subset(face_sizes, face_indices, uvs, keep):
+    """ Topology with only the faces selected by boolean mask """
+    loop_keep = np.repeat(keep, face_sizes)
+    return face_sizes[keep], face_indices[loop_keep], uvs[loop_keep]
+
+
+def clear_mesh_geometry(mesh):
+    """ True if mesh geometry can be refilled in place (Blender 2.81+) """
+    if not hasattr(mesh, 'clear_geometry'):
+        return False
+    mesh.clear_geometry()
+    return True
+
+
+def fill_mesh_geometry(mesh, verts, face_sizes, face_indices, uvs=None):
+    """ Bulk analog of mesh.from_pydata for an empty Blender mesh """
+    v_count = len(verts)
+    f_count = len(face_sizes)
+    FBMeshGeomUpdater.forget(mesh)
+
+    mesh.vertices.add(v_count)
+    mesh.vertices.foreach_set(
+        'co', np.ascontiguousarray(verts, dtype=np.float32).ravel())
+
+    mesh.loops.add(len(face_indices))
+    mesh.loops.foreach_set('vertex_index', face_indices)
+
+    mesh.polygons.add(f_count)
+    mesh.polygons.foreach_set('loop_start', loop_starts(face_sizes))
+    mesh.polygons.foreach_set('loop_total', face_sizes)
+    mesh.update(calc_edges=True)
+
+    # Simple Shade Smooth analog
+    mesh.polygons.foreach_set('use_smooth', np.ones(f_count, dtype=np.bool_))
+
+    if uvs is not None:
+        uvtex = mesh.uv_layers.new()
+        uvtex.data.foreach_set(
+            'uv', np.ascontiguousarray(uvs, dtype=np.float32).ravel())
+
+    mesh.update()
+    return mesh
+
+
+def add_uv_layers(mesh, layers):
+    """ Named UV layers from (name, per-loop uvs) pairs """
+    for name, uvs in layers:
+        uvtex = mesh.uv_layers.new(name=name)
+        uvtex.data.foreach_set(
+            'uv', np.ascontiguousarray(uvs, dtype=np.float32).ravel())
+    mesh.update()
+
+
+def select_uv_layer(mesh, name):
+    """ Make layer active and used for render. False if there is no one """
+    layer = mesh.uv_layers.get(name)
+    if layer is None:
+        return False
+    mesh.uv_layers.active = layer
+    layer.active_render = True
+    return True
+
+
+def set_custom_normals(mesh, normals):
+    """ Custom split normals from per-vertex (N, 3) array.
+    Previous auto smooth state is kept in mesh for disable_custom_normals """
+    prop_name = Config.exact_normals_prop_name[0]
+    if prop_name not in mesh.keys():
+        mesh[prop_name] = (float(mesh.use_auto_smooth),
+                           mesh.auto_smooth_angle)
+    # Custom normals are used by Blender only with auto smooth
+    mesh.use_auto_smooth = True
+    mesh.auto_smooth_angle = np.pi
+    mesh.normals_split_custom_set_from_vertices(
+        np.ascontiguousarray(normals, dtype=np.float32))
+    mesh.update()
+
+
+def disable_custom_normals(mesh):
+    """ Clear only normals applied by set_custom_normals
+    and restore auto smooth state. True if mesh has been changed """
+    prop_name = Config.exact_normals_prop_name[0]
+    if prop_name not in mesh.keys():
+        return False
+    use_auto_smooth, angle = mesh[prop_name]
+    del mesh[prop_name]
+    # Zero custom normals mean default ones
+    mesh.normals_split_custom_set_from_vertices(
+        np.zeros((len(mesh.vertices), 3), dtype=np.float32))
+    mesh.use_auto_smooth = bool(use_auto_smooth)
+    mesh.auto_smooth_angle = angle
+    mesh.update()
+    return True
+
+
+@persistent
+def _invalidate_geom_updater(scene):
+    FBMeshGeomUpdater.prune()
+    FBMeshGeomUpdater.invalidate()
+
+
+class FBMeshGeomUpdater:
+    """ Uploads vertices to Blender meshes only when they changed.
+    Per mesh it keeps uploaded and staging float32 buffers, so
+    no arrays are allocated on repeated updates of the same mesh.
+    State is keyed by mesh pointer and its vertex and loop counts,
+    since Blender reuses pointers of removed meshes """
+    _meshes = {}
+    # Shared counter, so versions are never repeated for new states
+    _last_version = 0
+    _handlers = (bpy.app.handlers.undo_post, bpy.app.handlers.redo_post,
+                 bpy.app.handlers.load_post)
+
+    @staticmethod
+    def _key(mesh):
+        return mesh.as_pointer(), len(mesh.vertices), len(mesh.loops)
+
+    @classmethod
+    def _get_state(cls, mesh):
+        key = cls._key(mesh)
+        state = cls._meshes.get(key)
+        if state is None:
+            cls.forget(mesh)
+            v_count = key[1]
+            state = {'uploaded': np.empty((v_count, 3), dtype=np.float32),
+                     'staging': np.empty((v_count, 3), dtype=np.float32),
+                     'equal': np.empty((v_count, 3), dtype=np.bool_),
+                     'valid': False, 'version': 0}
+            cls._meshes[key] = state
+        return state
+
+    @classmethod
+    def _upload(cls, mesh, state):
+        """ Staging buffer becomes uploaded one if it differs """
+        staging = state['staging']
+        uploaded = state['uploaded']
+        if state['valid']:
+            np.equal(staging, uploaded, out=state['equal'])
+            if state['equal'].all():
+                return False
+        state['uploaded'] = staging
+        state['staging'] = uploaded
+        state['valid'] = True
+        cls._last_version += 1
+        state['version'] = cls._last_version
+        mesh.vertices.foreach_set('co', staging.ravel())
+        mesh.update()
+        return True
+
+    @classmethod
+    def set_builder_vertices(cls, mesh, geom):
+        """ Builder coords, axis swap is done in preallocated buffer """
+        state = cls._get_state(mesh)
+        builder_to_blender_coords(geom, out=state['staging'])
+        return cls._upload(mesh, state)
+
+    @classmethod
+    def set_vertices(cls, mesh, verts):
+        """ Blender coords. True if mesh has been updated """
+        state = cls._get_state(mesh)
+        np.copyto(state['staging'], verts)
+        return cls._upload(mesh, state)
+
+    @classmethod
+    def get_vertices(cls, mesh):
+        """ (N, 3) mesh vertices, the last upload is used when valid.
+        Returned buffer may be reused by the next update """
+        state = cls._meshes.get(cls._key(mesh))
+        if state is not None and state['valid']:
+            return state['uploaded']
+        verts = np.empty((len(mesh.vertices), 3), dtype=np.float32)
+        mesh.vertices.foreach_get('co', verts.ravel())
+        return verts
+
+    @classmethod
+    def version(cls, mesh):
+        state = cls._meshes.get(cls._key(mesh))
+        return 0 if state is None else state['version']
+
+    @classmethod
+    def invalidate(cls, mesh=None):
+        """ Next update of mesh will be uploaded unconditionally """
+        if mesh is None:
+            for state in cls._meshes.values():
+                state['valid'] = False
+        else:
+            state = cls._meshes.get(cls._key(mesh))
+            if state is not None:
+                state['valid'] = False
+
+    @classmethod
+    def forget(cls, mesh):
+        """ Drop state of mesh to be created, replaced or removed """
+        pointer = mesh.as_pointer()
+        cls._meshes = {k: v for k, v in cls._meshes.items()
+                       if k[0] != pointer}
+
+    @classmethod
+    def prune(cls):
+        """ Drop states of meshes which are not in blend data anymore """
+        pointers = {mesh.as_pointer() for mesh in bpy.data.meshes}
+        cls._meshes = {k: v for k, v in cls._meshes.items()
+                       if k[0] in pointers}
+
+    @classmethod
+    def register_handlers(cls):
+        for handlers in cls._handlers:
+            if _invalidate_geom_updater not in handlers:
+                handlers.append(_invalidate_geom_updater)
+
+    @classmethod
+    def unregister_handlers(cls):
+        for handlers in cls._handlers:
+            if _invalidate_geom_updater in handlers:
+                handlers.remove(_invalidate_geom_updater)
+        cls._meshes = {}
+
+
+class FBMeshTopologyCache:
+    """ Builder face connectivity and UV layout storage.
+    Topology of a builder mesh depends only on (builder type,
+    model version, masks, uv set), so only vertex positions
+    have to be requested from the builder on cache hit.
+    Faces removed by every single mask part are stored separately,
+    so any masked topology is a subset of the full one """
+    _topology = {}
+    _part_faces = {}
+    _corners = {}
+    _hits = 0
+    _misses = 0
+
+    @staticmethod
+    def make_key(builder_type, version, masks=(), uv_set='uv0'):
+        return builder_type, version, tuple(masks), uv_set
+
+    @classmethod
+    def get(cls, key):
+        topology = cls._topology.get(key)
+        if topology is None:
+            cls._misses += 1
+        else:
+            cls._hits += 1
+        return topology
+
+    @classmethod
+    def put(cls, key, face_sizes, face_indices, uvs):
+        for arr in (face_sizes, face_indices, uvs):
+            arr.flags.writeable = False
+        cls._topology[key] = (face_sizes, face_indices, uvs)
+        return cls._topology[key]
+
+    @classmethod
+    def find_faces(cls, key):
+        """ Face arrays do not depend on uv set, so any set will do """
+        for k, topology in cls._topology.items():
+            if k[:3] == key[:3]:
+                return topology[:2]
+        return None
+
+    @classmethod
+    def get_part_faces(cls, key, part):
+        return cls._part_faces.get((key[0], key[1], part))
+
+    @classmethod
+    def put_part_faces(cls, key, part, removed):
+        removed.flags.writeable = False
+        cls._part_faces[(key[0], key[1], part)] = removed
+        return removed
+
+    @classmethod
+    def get_corner_vertices(cls, key):
+        """ Vertex indices of builder mesh corners in native face order """
+        return cls._corners.get(key[:3])
+
+    @classmethod
+    def put_corner_vertices(cls, key, face_indices):
+        face_indices.flags.writeable = False
+        cls._corners[key[:3]] = face_indices
+        return face_indices
+
+    @classmethod
+    def invalidate(cls, builder_type=None):
+        if builder_type is None:
+            cls._topology = {}
+            cls._part_faces = {}
+            cls._corners = {}
+        else:
+            cls._corners = {k: v for k, v in cls._corners.items()
+                            if k[0] != builder_type}
+            cls._topology = {k: v for k, v in cls._topology.items()
+                             if k[0] != builder_type}
+            cls._part_faces = {k: v for k, v in cls._part_faces.items()
+                               if k[0] != builder_type}
+
+    @classmethod
+    def hits(cls):
+        return cls._hits
+
+    @classmethod
+    def misses(cls):
+        return cls._misses
+
+    @classmethod
+    def reset_counters(cls):
+        cls._hits = 0
+        cls._misses = 0
@@ -0,0 +1,102 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+# KeenTools for blender is a blender addon for using KeenTools in Blender.
+# Copyright (C) 2019  KeenTools
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+
+import numpy as np
+
+
+class FBPinCache:
+    """ Builder pins of every keyframe as arrays: image positions,
+    surface triangle vertex indices and barycentric weights.
+    Pins are requested from builder only on first access after change,
+    so builder pins must be changed only through FBLoader methods """
+    _keyframes = {}
+    _serial = None
+    _native_calls = 0
+    _hits = 0
+
+    @classmethod
+    def _load(cls, fb, keyframe):
+        count = fb.pins_count(keyframe)
+        img_pos = np.empty((count, 2), dtype=np.float64)
+        geo_idxs = np.empty((count, 3), dtype=np.int32)
+        weights = np.empty((count, 3), dtype=np.float32)
+        for i in range(count):
+            pin = fb.pin(keyframe, i)
+            img_pos[i] = pin.img_pos
+            sp = pin.surface_point
+            geo_idxs[i] = sp.geo_point_idxs[:3]
+            weights[i] = sp.barycentric_coordinates[:3]
+        cls._native_calls += count + 1
+        for arr in (img_pos, geo_idxs, weights):
+            arr.flags.writeable = False
+        return img_pos, geo_idxs, weights
+
+    @classmethod
+    def get(cls, fb, keyframe):
+        """ Read-only (img_pos, geo_idxs, weights) of keyframe pins """
+        data = cls._keyframes.get(keyframe)
+        if data is None:
+            data = cls._load(fb, keyframe)
+            cls._keyframes[keyframe] = data
+        else:
+            cls._hits += 1
+        return data
+
+    @classmethod
+    def pins_count(cls, fb, keyframe):
+        return len(cls.get(fb, keyframe)[0])
+
+    @classmethod
+    def img_pos(cls, fb, keyframe):
+        """ (N, 2) pin positions in frame pixels """
+        return cls.get(fb, keyframe)[0]
+
+    @classmethod
+    def attachments(cls, fb, keyframe):
+        """ (N, 3) surface vertex indices and (N, 3) barycentrics """
+        _, geo_idxs, weights = cls.get(fb, keyframe)
+        return geo_idxs, weights
+
+    @classmethod
+    def invalidate(cls, keyframe=None):
+        """ Call on any pin change of keyframe or all keyframes """
+        if keyframe is None:
+            cls._keyframes = {}
+        else:
+            cls._keyframes.pop(keyframe, None)
+        cls._serial = None
+
+    @classmethod
+    def on_deserialize(cls, serial_str):
+        if serial_str != cls._serial:
+            cls.invalidate()
+            cls._serial = serial_str
+
+    @classmethod
+    def native_calls(cls):
+        """ pins_count and pin calls made to builder by the cache """
+        return cls._native_calls
+
+    @classmethod
+    def hits(cls):
+        return cls._hits
+
+    @classmethod
+    def reset_counters(cls):
+        cls._native_calls = 0
+        cls._hits = 0
@@ -18,6 +18,7 @@
 
 import bpy
 import gpu
+import numpy as np
 import bgl
 from gpu_extras.batch import batch_for_shader
 from . shaders import flat_color_3d_vertex_shader, \
@@ -124,6 +125,11 @@ class FBShaderPoints:
         self.add_color_vertices(color, verts)
 
     def set_vertices_colors(self, verts, colors):
+        if isinstance(verts, np.ndarray) and isinstance(colors, np.ndarray):
+            # Arrays go to the batch as is
+            self.vertices = verts
+            self.vertices_colors = colors
+            return
         self.clear_vertices()
         self.add_vertices_colors(verts, colors)
 
@@ -147,11 +153,36 @@ class FBShaderPoints:
 
 class FBPoints2D(FBShaderPoints):
     """ 2D Shader for 2D-points drawing """
+    def __init__(self):
+        super().__init__()
+        self.highlight_batch = None
+
     def create_batch(self):
         self._create_batch(
             # 2D_FLAT_COLOR
             self.vertices, self.vertices_colors, 'CUSTOM_2D')
 
+    def set_highlight(self, vertex, color):
+        """ One point drawn over the others in other color.
+        Highlight changes do not touch the main batch """
+        if vertex is None or self.shader is None or bpy.app.background:
+            self.highlight_batch = None
+            return
+        self.highlight_batch = batch_for_shader(
+            self.shader, 'POINTS', {"pos": [vertex], "color": [color]})
+
+    def draw_callback(self, op, context):
+        super().draw_callback(op, context)
+        # Handler could be removed by the call above
+        if self.draw_handler is None or self.highlight_batch is None \
+                or self.shader is None:
+            return
+        bgl.glPointSize(self.point_size)
+        bgl.glEnable(bgl.GL_BLEND)
+        self.shader.bind()
+        self.highlight_batch.draw(self.shader)
+        bgl.glDisable(bgl.GL_BLEND)
+
     def register_handler(self, args):
         self.draw_handler = bpy.types.SpaceView3D.draw_handler_add(
             self.draw_callback, args, "WINDOW", "POST_PIXEL")
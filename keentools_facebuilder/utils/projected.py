@@ -0,0 +1,101 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+# KeenTools for blender is a blender addon for using KeenTools in Blender.
+# Copyright (C) 2019  KeenTools
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+
+import math
+
+import bpy
+import numpy as np
+
+from . import coords
+from .meshes import FBMeshGeomUpdater
+from .spatial import FBPointGrid
+
+
+class FBProjectedVertices:
+    """ Head vertices projected into image space of every camera keyframe
+    with grid index for nearest vertex queries.
+    Projection is rebuilt only after solves, camera, focal or mesh changes """
+    _entries = {}
+    _version = 0
+    _serial = None
+    _builds = 0
+
+    @staticmethod
+    def _make_key(headobj, camobj, projection, version):
+        render = bpy.context.scene.render
+        return (version, FBMeshGeomUpdater.version(headobj.data),
+                len(headobj.data.vertices),
+                tuple(c for row in headobj.matrix_world for c in row),
+                tuple(c for row in camobj.matrix_world for c in row),
+                tuple(projection.ravel().tolist()),
+                render.resolution_x, render.resolution_y)
+
+    @classmethod
+    def get(cls, fb, headobj, camobj, keyframe):
+        """ (N, 2) float32 projected vertices and their FBPointGrid """
+        # Focal length changes update projection without any invalidation
+        projection = np.asarray(fb.projection_mat(keyframe))
+        key = cls._make_key(headobj, camobj, projection, cls._version)
+        entry = cls._entries.get(keyframe)
+        if entry is not None and entry[0] == key:
+            return entry[1], entry[2]
+
+        verts = FBMeshGeomUpdater.get_vertices(headobj.data)
+        points = coords.project_to_image_space(
+            verts, headobj.matrix_world, camobj.matrix_world,
+            projection, key[-2], key[-1]).astype(np.float32)
+        points.flags.writeable = False
+        grid = FBPointGrid()
+        if entry is not None:
+            grid.build(points.tolist(), entry[2].cell_size())
+        else:
+            grid.build(points.tolist())
+        cls._entries[keyframe] = (key, points, grid)
+        cls._builds += 1
+        return points, grid
+
+    @classmethod
+    def nearest(cls, fb, headobj, camobj, keyframe, x, y, dist2):
+        """ (vertex index, (x, y) image position) or (-1, None) """
+        points, grid = cls.get(fb, headobj, camobj, keyframe)
+        grid.ensure_cell_size(math.sqrt(dist2))
+        idx, _ = grid.nearest(x, y, dist2)
+        if idx < 0:
+            return -1, None
+        return idx, tuple(points[idx].tolist())
+
+    @classmethod
+    def invalidate(cls):
+        """ Call after solve or any camera projection change """
+        cls._entries = {}
+        cls._version += 1
+        cls._serial = None
+
+    @classmethod
+    def on_deserialize(cls, serial_str):
+        if serial_str != cls._serial:
+            cls.invalidate()
+            cls._serial = serial_str
+
+    @classmethod
+    def builds(cls):
+        return cls._builds
+
+    @classmethod
+    def reset_counters(cls):
+        cls._builds = 0
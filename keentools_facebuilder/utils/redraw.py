@@ -0,0 +1,80 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+# KeenTools for blender is a blender addon for using KeenTools in Blender.
+# Copyright (C) 2019  KeenTools
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+
+import time
+
+
+class FBRedrawScheduler:
+    """ Dirty flags for pinmode batches.
+    Every input has a version number, a batch is dirty when one of its
+    inputs has changed since the batch was rebuilt last time """
+    _dependencies = {
+        'pins2d': ('pins', 'border', 'colors'),
+        'residuals': ('pins', 'solve', 'border', 'mesh'),
+    }
+    _versions = {}
+    _dirty = set(_dependencies.keys())
+    _rebuilds = {}
+    _start_time = time.perf_counter()
+
+    @classmethod
+    def check_inputs(cls, **versions):
+        """ Mark dirty batches depending on changed inputs """
+        for name, version in versions.items():
+            if cls._versions.get(name) != version:
+                cls._versions[name] = version
+                cls.mark_dirty(name)
+
+    @classmethod
+    def mark_dirty(cls, input_name):
+        for batch, inputs in cls._dependencies.items():
+            if input_name in inputs:
+                cls._dirty.add(batch)
+
+    @classmethod
+    def mark_all_dirty(cls):
+        cls._dirty = set(cls._dependencies.keys())
+
+    @classmethod
+    def need_rebuild(cls, batch):
+        return batch in cls._dirty
+
+    @classmethod
+    def is_idle(cls):
+        return len(cls._dirty) == 0
+
+    @classmethod
+    def rebuilt(cls, batch):
+        cls._dirty.discard(batch)
+        cls._rebuilds[batch] = cls._rebuilds.get(batch, 0) + 1
+
+    @classmethod
+    def rebuilds(cls, batch):
+        return cls._rebuilds.get(batch, 0)
+
+    @classmethod
+    def rebuilds_per_second(cls):
+        """ Rebuild rate of every batch since the last counters reset """
+        elapsed = max(time.perf_counter() - cls._start_time, 1e-6)
+        return {batch: cls.rebuilds(batch) / elapsed
+                for batch in cls._dependencies}
+
+    @classmethod
+    def reset_counters(cls):
+        cls._rebuilds = {}
+        cls._start_time = time.perf_counter()
@@ -146,3 +146,34 @@ def residual_fragment_shader():
         fragColor = finalColor;
     }
     '''
+
+
+def wireframe_vertex_shader():
+    return '''
+    uniform mat4 ModelViewProjectionMatrix;
+
+    in vec3 pos;
+    in float special;
+    flat out float isSpecial;
+
+    void main()
+    {
+        gl_Position = ModelViewProjectionMatrix * vec4(pos, 1.0);
+        isSpecial = special;
+    }
+    '''
+
+
+def wireframe_fragment_shader():
+    return '''
+    uniform vec3 mainColor;
+    uniform vec3 specialColor;
+    uniform float opacity;
+    flat in float isSpecial;
+    out vec4 fragColor;
+
+    void main()
+    {
+        fragColor = vec4(mix(mainColor, specialColor, isSpecial), opacity);
+    }
+    '''
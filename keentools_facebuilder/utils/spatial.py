@@ -0,0 +1,130 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+# KeenTools for blender is a blender addon for using KeenTools in Blender.
+# Copyright (C) 2019  KeenTools
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+import math
+
+import numpy as np
+
+
+class FBPointGrid:
+    """ Uniform grid index over 2D points for hit-testing.
+    Queries follow coords.nearest_point semantics: squared distance
+    must be strictly less than the limit, ties go to the lowest index """
+    def __init__(self, cell_size=0.01):
+        self._cell_size = cell_size
+        self._points = []
+        self._cells = {}
+
+    def _cell(self, p):
+        return (math.floor(p[0] / self._cell_size),
+                math.floor(p[1] / self._cell_size))
+
+    def cell_size(self):
+        return self._cell_size
+
+    def build(self, points, cell_size=None):
+        if cell_size is not None and cell_size > 0:
+            self._cell_size = cell_size
+        self._points = [(p[0], p[1]) for p in points]
+        self._cells = {}
+        for i, p in enumerate(self._points):
+            self._cells.setdefault(self._cell(p), []).append(i)
+
+    def ensure_cell_size(self, radius):
+        """ Rebuild when query radius is far from cell size (zoom) """
+        if radius <= 0:
+            return
+        if radius > 2 * self._cell_size or radius < 0.5 * self._cell_size:
+            self.build(self._points, radius)
+
+    def add(self, p):
+        self._points.append((p[0], p[1]))
+        idx = len(self._points) - 1
+        self._cells.setdefault(self._cell(p), []).append(idx)
+        return idx
+
+    def _discard(self, key, idx):
+        cell = self._cells[key]
+        cell.remove(idx)
+        if not cell:
+            del self._cells[key]
+
+    def move(self, idx, p):
+        old_cell = self._cell(self._points[idx])
+        new_cell = self._cell(p)
+        self._points[idx] = (p[0], p[1])
+        if old_cell != new_cell:
+            self._discard(old_cell, idx)
+            self._cells.setdefault(new_cell, []).append(idx)
+
+    def remove(self, idx):
+        """ Following indices are shifted, so the grid is rebuilt """
+        del self._points[idx]
+        self.build(self._points)
+
+    def swap_remove(self, idx):
+        """ The last point takes index idx, only two cells are changed """
+        last = len(self._points) - 1
+        self._discard(self._cell(self._points[idx]), idx)
+        if idx != last:
+            p = self._points[last]
+            cell = self._cells[self._cell(p)]
+            cell[cell.index(last)] = idx
+            self._points[idx] = p
+        self._points.pop()
+
+    def _candidates(self, x, y, radius):
+        cs = self._cell_size
+        i0 = math.floor((x - radius) / cs)
+        i1 = math.floor((x + radius) / cs)
+        j0 = math.floor((y - radius) / cs)
+        j1 = math.floor((y + radius) / cs)
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self._cells):
+            return np.arange(len(self._points))
+        indices = []
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                indices.extend(self._cells.get((i, j), ()))
+        return np.array(sorted(indices), dtype=np.int64)
+
+    def _dist2(self, x, y, indices):
+        pts = np.array([self._points[i] for i in indices],
+                       dtype=np.float64).reshape((-1, 2))
+        return (pts[:, 0] - x) ** 2 + (pts[:, 1] - y) ** 2
+
+    def nearest(self, x, y, max_dist2):
+        """ (index, dist2) or (-1, max_dist2) if nothing is close enough """
+        if not self._points or max_dist2 <= 0:
+            return -1, max_dist2
+        indices = self._candidates(x, y, math.sqrt(max_dist2))
+        if len(indices) == 0:
+            return -1, max_dist2
+        d2 = self._dist2(x, y, indices)
+        best = int(np.argmin(d2))  # first minimum is the lowest index
+        if d2[best] < max_dist2:
+            return int(indices[best]), float(d2[best])
+        return -1, max_dist2
+
+    def in_radius(self, x, y, max_dist2):
+        """ Sorted indices of points with dist2 < max_dist2 """
+        if not self._points or max_dist2 <= 0:
+            return []
+        indices = self._candidates(x, y, math.sqrt(max_dist2))
+        if len(indices) == 0:
+            return []
+        d2 = self._dist2(x, y, indices)
+        return indices[d2 < max_dist2].tolist()
@@ -0,0 +1,51 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+# KeenTools for blender is a blender addon for using KeenTools in Blender.
+# Copyright (C) 2019  KeenTools
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+import numpy as np
+
+from .meshes import FBMeshGeomUpdater
+from .pincache import FBPinCache
+
+
+class FBSurfacePoints:
+    """ Surface points of all pins evaluated at once
+    from pin attachments kept by FBPinCache """
+    @classmethod
+    def attachments(cls, fb, keyframes):
+        """ Concatenated (geo_idxs, weights, pins count per keyframe) """
+        data = [FBPinCache.attachments(fb, k) for k in keyframes]
+        counts = [len(d[0]) for d in data]
+        if not data:
+            return (np.empty((0, 3), dtype=np.int32),
+                    np.empty((0, 3), dtype=np.float32), counts)
+        return (np.concatenate([d[0] for d in data]),
+                np.concatenate([d[1] for d in data]), counts)
+
+    @classmethod
+    def evaluate(cls, verts, geo_idxs, weights):
+        """ (N, 3) float32 points from (V, 3) vertices """
+        return np.einsum('ij,ijk->ik', weights,
+                         verts[geo_idxs]).astype(np.float32, copy=False)
+
+    @classmethod
+    def points(cls, fb, mesh, keyframes):
+        """ Surface points of all pins of keyframes in mesh coords """
+        geo_idxs, weights, counts = cls.attachments(fb, keyframes)
+        if len(geo_idxs) == 0:
+            return np.empty((0, 3), dtype=np.float32), counts
+        verts = FBMeshGeomUpdater.get_vertices(mesh)
+        return cls.evaluate(verts, geo_idxs, weights), counts
@@ -17,6 +17,7 @@
 # ##### END GPL LICENSE BLOCK #####
 import cProfile
 import logging
+import math
 import bpy
 
 import numpy as np
@@ -27,24 +28,173 @@ from . utils import coords
 from . utils.edges import FBEdgeShader3D, FBEdgeShader2D
 from . utils.other import FBText
 from . utils.points import FBPoints2D, FBPoints3D
+from . utils.spatial import FBPointGrid
+from . utils.surface import FBSurfacePoints
+from . utils.pincache import FBPinCache
+from . utils.projected import FBProjectedVertices
 
 
 class FBScreenPins:
-    _pins = []
+    """ Image space pins of current view.
+    Positions are (N, 2) float32, states are per-pin bit flags """
+    PIN_SELECTED = 1
+
+    _positions = np.empty((0, 2), dtype=np.float32)
+    _states = np.empty(0, dtype=np.uint8)
+    _count = 0
+    _version = 0
     _current_pin = None
     _current_pin_num = -1
+    _hover_pin = -1
+    _keyframe = None
+    # Hit-testing index, pins must be changed only by methods below
+    _grid = FBPointGrid()
 
     @classmethod
     def arr(cls):
-        return cls._pins
+        """ View of (N, 2) positions, valid until the next change """
+        return cls._positions[:cls._count]
+
+    @classmethod
+    def states(cls):
+        return cls._states[:cls._count]
+
+    @classmethod
+    def count(cls):
+        return cls._count
+
+    @classmethod
+    def version(cls):
+        """ Incremented on every change of pins """
+        return cls._version
+
+    @classmethod
+    def _changed(cls):
+        cls._version += 1
+
+    @classmethod
+    def _reserve(cls, count):
+        capacity = len(cls._positions)
+        if count <= capacity:
+            return
+        capacity = max(count, 2 * capacity, 16)
+        positions = np.empty((capacity, 2), dtype=np.float32)
+        positions[:cls._count] = cls._positions[:cls._count]
+        states = np.zeros(capacity, dtype=np.uint8)
+        states[:cls._count] = cls._states[:cls._count]
+        cls._positions = positions
+        cls._states = states
 
     @classmethod
-    def set_pins(cls, arr):
-        cls._pins = arr
+    def set_pins(cls, arr, keyframe=None):
+        """ Selection is kept on reload of the same keyframe pins """
+        arr = np.asarray(arr, dtype=np.float32).reshape((-1, 2))
+        keep_states = keyframe is not None and keyframe == cls._keyframe \
+            and len(arr) == cls._count
+        cls._keyframe = keyframe
+        if not keep_states:
+            cls._count = 0
+        cls._reserve(len(arr))
+        cls._count = len(arr)
+        cls._positions[:cls._count] = arr
+        if not keep_states:
+            cls._states[:cls._count] = 0
+        cls._hover_pin = -1
+        cls._grid.build(arr.tolist())
+        cls._changed()
 
     @classmethod
     def add_pin(cls, vec2d):
-        cls._pins.append(vec2d)
+        cls._reserve(cls._count + 1)
+        cls._positions[cls._count] = vec2d
+        cls._states[cls._count] = 0
+        cls._count += 1
+        cls._grid.add(vec2d)
+        cls._changed()
+
+    @classmethod
+    def move_pin(cls, index, vec2d):
+        cls._positions[index] = vec2d
+        cls._grid.move(index, vec2d)
+        cls._changed()
+
+    @classmethod
+    def remove_pin(cls, index):
+        """ Order is kept the same as pin order in builder """
+        last = cls._count - 1
+        cls._positions[index:last] = cls._positions[index + 1:cls._count]
+        cls._states[index:last] = cls._states[index + 1:cls._count]
+        cls._count = last
+        cls._hover_pin = -1
+        cls._grid.remove(index)
+        cls._changed()
+
+    @classmethod
+    def swap_remove(cls, index):
+        """ O(1) removal for pins not mirrored by builder indices """
+        last = cls._count - 1
+        cls._positions[index] = cls._positions[last]
+        cls._states[index] = cls._states[last]
+        cls._count = last
+        cls._hover_pin = -1
+        cls._grid.swap_remove(index)
+        cls._changed()
+
+    @classmethod
+    def set_selected(cls, index, value=True):
+        if value:
+            cls._states[index] |= cls.PIN_SELECTED
+        else:
+            cls._states[index] &= ~np.uint8(cls.PIN_SELECTED)
+        cls._changed()
+
+    @classmethod
+    def is_selected(cls, index):
+        return bool(cls._states[index] & cls.PIN_SELECTED)
+
+    @classmethod
+    def toggle_selected(cls, index):
+        cls.set_selected(index, not cls.is_selected(index))
+
+    @classmethod
+    def clear_selection(cls):
+        if not (cls.states() & cls.PIN_SELECTED).any():
+            return
+        cls._states[:cls._count] &= ~np.uint8(cls.PIN_SELECTED)
+        cls._changed()
+
+    @classmethod
+    def select_in_rect(cls, x1, y1, x2, y2, extend=False):
+        """ Select pins inside image space rectangle """
+        arr = cls.arr()
+        inside = (arr[:, 0] >= min(x1, x2)) & (arr[:, 0] <= max(x1, x2)) \
+            & (arr[:, 1] >= min(y1, y2)) & (arr[:, 1] <= max(y1, y2))
+        states = cls.states()
+        if not extend:
+            states &= ~np.uint8(cls.PIN_SELECTED)
+        states[inside] |= cls.PIN_SELECTED
+        cls._changed()
+        return np.flatnonzero(inside)
+
+    @classmethod
+    def selected_indices(cls):
+        return np.flatnonzero(cls.states() & cls.PIN_SELECTED)
+
+    @classmethod
+    def to_region(cls, x1, y1, x2, y2):
+        """ Pin positions in region (screen) space """
+        return coords.image_space_to_region_arr(cls.arr(), x1, y1, x2, y2)
+
+    @classmethod
+    def nearest_pin(cls, x, y, dist2):
+        """ Nearest pin index closer than sqrt(dist2) or -1 """
+        cls._grid.ensure_cell_size(math.sqrt(dist2))
+        return cls._grid.nearest(x, y, dist2)
+
+    @classmethod
+    def pins_in_radius(cls, x, y, dist2):
+        cls._grid.ensure_cell_size(math.sqrt(dist2))
+        return cls._grid.in_radius(x, y, dist2)
 
     @classmethod
     def current_pin_num(cls):
@@ -56,7 +206,7 @@ class FBScreenPins:
 
     @classmethod
     def set_current_pin_num_to_last(cls):
-        cls._current_pin_num = len(cls.arr()) - 1
+        cls._current_pin_num = cls._count - 1
 
     @classmethod
     def current_pin(cls):
@@ -71,6 +221,15 @@ class FBScreenPins:
         cls._current_pin = None
         cls._current_pin_num = -1
 
+    @classmethod
+    def hover_pin(cls):
+        """ Index of pin under cursor or -1 """
+        return cls._hover_pin
+
+    @classmethod
+    def set_hover_pin(cls, index):
+        cls._hover_pin = index
+
 
 class FBViewport:
     profiling = False
@@ -92,6 +251,12 @@ class FBViewport:
     _draw_timer_handler = None
 
     _residuals = FBEdgeShader2D()
+    # Box selection frame
+    _selection_box = FBEdgeShader2D()
+    # Pins and camera border versions the 2D batch was built for
+    _batch_2d_key = None
+    # Special edge vertex pairs per builder type
+    _special_pairs = {}
 
     # Pins
     _pins = FBScreenPins()
@@ -123,6 +288,10 @@ class FBViewport:
     def residuals(cls):
         return cls._residuals
 
+    @classmethod
+    def selection_box(cls):
+        return cls._selection_box
+
     @classmethod
     def update_view_relative_pixel_size(cls, context):
         ps = coords.get_pixel_relative_size(context)
@@ -136,6 +305,41 @@ class FBViewport:
     def tolerance_dist2(cls):  # squared distance
         return (cls.POINT_SENSITIVITY * cls.PIXEL_SIZE)**2
 
+    @classmethod
+    def snap_to_vertex(cls, fb, headobj, camobj, keyframe, x, y):
+        """ Position of the nearest projected head vertex in pin handle
+        radius or the same (x, y) if there is no one """
+        idx, pos = FBProjectedVertices.nearest(
+            fb, headobj, camobj, keyframe, x, y, cls.tolerance_dist2())
+        return (x, y) if idx < 0 else pos
+
+    @classmethod
+    def update_hover(cls, context, mouse_x, mouse_y):
+        """ True when pin under cursor has changed.
+        Only the one highlighted point is redrawn in this case """
+        pins = cls.pins()
+        cls.update_view_relative_pixel_size(context)
+        x, y = coords.get_image_space_coord(mouse_x, mouse_y, context)
+        nearest, _ = pins.nearest_pin(x, y, cls.tolerance_dist2())
+        if nearest == pins.hover_pin():
+            return False
+        pins.set_hover_pin(nearest)
+        cls.update_hover_point(context)
+        return True
+
+    @classmethod
+    def update_hover_point(cls, context):
+        pins = cls.pins()
+        idx = pins.hover_pin()
+        if idx < 0 or idx >= pins.count() or pins.current_pin() is not None:
+            cls.points2d().set_highlight(None, None)
+            return
+        x, y = pins.arr()[idx].tolist()
+        cls.points2d().set_highlight(
+            coords.image_space_to_region(
+                x, y, *coords.get_camera_border(context)),
+            Config.hover_pin_color)
+
     @classmethod
     def in_pin_drag(cls):
         pins = cls.pins()
@@ -148,6 +352,7 @@ class FBViewport:
         cls.unregister_handlers()  # Experimental
 
         cls.residuals().register_handler(args)
+        cls.selection_box().register_handler(args)
 
         cls.points3d().register_handler(args)
         cls.points2d().register_handler(args)
@@ -172,6 +377,7 @@ class FBViewport:
         cls.points3d().unregister_handler()
 
         cls.residuals().unregister_handler()
+        cls.selection_box().unregister_handler()
     # --------
 
     # --------------------
@@ -192,35 +398,36 @@ class FBViewport:
             vv[:, :-1] = verts
             vv = vv @ m
             # Transformed vertices
-            verts = vv[:, :3]
+            verts = np.ascontiguousarray(vv[:, :3])
 
         cls.points3d().set_vertices_colors(verts, colors)
         cls.points3d().create_batch()
 
     @classmethod
-    def update_wireframe(cls, builder_type, obj):
-        logger = logging.getLogger(__name__)
+    def update_wireframe_colors(cls):
+        """ Colors and opacity are shader uniforms, so no batch rebuild """
         settings = get_main_settings()
         main_color = settings.wireframe_color
-        comp_color = settings.wireframe_special_color
-
-        cls.wireframer().init_color_data((*main_color,
-                                          settings.wireframe_opacity))
-        if settings.show_specials:
-            mesh = obj.data
-            # Check to prevent shader problem
-            if len(mesh.edges) * 2 == len(cls.wireframer().edges_colors):
-                logger.debug("COLORING")
-                special_indices = cls.get_special_indices(builder_type)
-                cls.wireframer().init_special_areas(
-                    obj.data, special_indices, (*comp_color,
-                                                settings.wireframe_opacity))
-            else:
-                logging.warning("LISTS HAVE DIFFERENT SIZES")
+        comp_color = settings.wireframe_special_color \
+            if settings.show_specials else main_color
+        cls.wireframer().set_colors(
+            main_color, comp_color,
+            settings.overall_opacity * settings.wireframe_opacity)
+
+    @classmethod
+    def update_wireframe(cls, builder_type, obj):
+        cls.wireframer().init_special_areas(
+            obj.data, cls.get_special_indices(builder_type))
+        cls.update_wireframe_colors()
         cls.wireframer().create_batches()
 
     @classmethod
     def get_special_indices(cls, builder_type):
+        """ (N, 2) array of special edge vertex pairs.
+        It is built once, so the same object is returned for builder type """
+        pairs = cls._special_pairs.get(builder_type)
+        if pairs is not None:
+            return pairs
         if builder_type == BuilderType.FaceBuilder:
             pairs = const.get_eyes_indices()
             pairs = pairs.union(const.get_eyebrows_indices())
@@ -229,10 +436,14 @@ class FBViewport:
             pairs = pairs.union(const.get_ears_indices())
             pairs = pairs.union(const.get_half_indices())
             # pairs = pairs.union(const.get_jaw_indices2())
-            return pairs
         elif builder_type == BuilderType.BodyBuilder:
-            return const.get_bodybuilder_highlight_indices()
-        return {}
+            pairs = const.get_bodybuilder_highlight_indices()
+        else:
+            pairs = ()
+        pairs = np.array(sorted(pairs), dtype=np.int32).reshape((-1, 2))
+        pairs.flags.writeable = False
+        cls._special_pairs[builder_type] = pairs
+        return pairs
 
     @classmethod
     def update_pin_sensitivity(cls):
@@ -249,82 +460,89 @@ class FBViewport:
     @classmethod
     def surface_points(cls, fb, headobj, keyframe=-1,
                        allcolor=(0, 0, 1, 0.15), selcolor=(0, 1, 0, 1)):
-        verts = []
-        colors = []
-
-        for k in fb.keyframes():
-            for i in range(fb.pins_count(k)):
-                pin = fb.pin(k, i)
-                p = coords.pin_to_xyz(pin, headobj)
-                verts.append(p)
-                if k == keyframe:
-                    colors.append(selcolor)
-                else:
-                    colors.append(allcolor)
+        keyframes = fb.keyframes()
+        verts, counts = FBSurfacePoints.points(fb, headobj.data, keyframes)
+        colors = np.empty((len(verts), 4), dtype=np.float32)
+        colors[:] = allcolor
+        start = 0
+        for k, count in zip(keyframes, counts):
+            if k == keyframe:
+                colors[start:start + count] = selcolor
+            start += count
         return verts, colors
 
     @classmethod
     def surface_points_only(cls, fb, headobj, keyframe=-1):
-        verts = []
-
-        for i in range(fb.pins_count(keyframe)):
-            pin = fb.pin(keyframe, i)
-            p = coords.pin_to_xyz(pin, headobj)
-            verts.append(p)
+        verts, _ = FBSurfacePoints.points(fb, headobj.data, [keyframe])
         return verts
 
     @classmethod
     def img_points(cls, fb, keyframe):
+        """ (N, 2) pins positions in image space """
         scene = bpy.context.scene
         w = scene.render.resolution_x
         h = scene.render.resolution_y
 
-        pins_count = fb.pins_count(keyframe)
-
-        verts = []
-        for i in range(pins_count):
-            pin = fb.pin(keyframe, i)
-            x, y = pin.img_pos
-            verts.append((coords.frame_to_image_space(x, y, w, h)))
-        return verts
+        return coords.frame_to_image_space_arr(
+            FBPinCache.img_pos(fb, keyframe), w, h)
 
     @classmethod
     def create_batch_2d(cls, context):
         """ Main Pin Draw Batch"""
-        points = cls.pins().arr().copy()
+        pins = cls.pins()
+        count = pins.count()
+
+        x1, y1, x2, y2 = coords.get_camera_border(context)
+        batch_key = (pins.version(), coords.FBCameraBorder.version(),
+                     pins.current_pin() is not None, pins.current_pin_num())
+        if batch_key == cls._batch_2d_key \
+                and cls.points2d().batch is not None:
+            return
+        cls._batch_2d_key = batch_key
 
         scene = context.scene
         rx = scene.render.resolution_x
         ry = scene.render.resolution_y
         asp = ry / rx
 
-        x1, y1, x2, y2 = coords.get_camera_border(context)
-
-        for i, p in enumerate(points):
-            x, y = coords.image_space_to_region(p[0], p[1], x1, y1, x2, y2)
-            points[i] = (x, y)
-
-        vertex_colors = [Config.pin_color for _ in range(len(points))]
-
-        pins = cls.pins()
-        if pins.current_pin() and pins.current_pin_num() < len(vertex_colors):
+        # Pins and camera corners
+        points = np.empty((count + 2, 2), dtype=np.float32)
+        points[:count] = pins.arr()
+        points[count:] = ((-0.5, -asp * 0.5), (0.5, asp * 0.5))
+        points = coords.image_space_to_region_arr(
+            points, x1, y1, x2, y2).astype(np.float32)
+
+        vertex_colors = np.empty((count + 2, 4), dtype=np.float32)
+        vertex_colors[:count] = Config.pin_color
+        vertex_colors[:count][(pins.states() & pins.PIN_SELECTED) > 0] = \
+            Config.selected_pin_color
+        if pins.current_pin() is not None \
+                and 0 <= pins.current_pin_num() < count:
             vertex_colors[pins.current_pin_num()] = Config.current_pin_color
-
-        # Camera corners
-        points.append(
-            (coords.image_space_to_region(
-                -0.5, -asp * 0.5, x1, y1, x2, y2))
-        )
-        points.append(
-            (coords.image_space_to_region(
-                0.5, asp * 0.5,
-                x1, y1, x2, y2))
-        )
-        vertex_colors.append((1.0, 0.0, 1.0, 0.2))  # left camera corner
-        vertex_colors.append((1.0, 0, 1.0, 0.2))  # right camera corner
+        vertex_colors[count:] = (1.0, 0.0, 1.0, 0.2)  # camera corners
 
         cls.points2d().set_vertices_colors(points, vertex_colors)
         cls.points2d().create_batch()
+        cls.update_hover_point(context)
+
+    @classmethod
+    def update_selection_box(cls, context, start=None, end=None):
+        """ Dashed frame between image space corners, None hides it """
+        box = cls.selection_box()
+        box.clear_vertices()
+        box.edge_lengths = []
+        if start is not None and end is not None:
+            x1, y1, x2, y2 = coords.get_camera_border(context)
+            (ax, ay), (bx, by) = coords.image_space_to_region_arr(
+                (start, end), x1, y1, x2, y2).tolist()
+            corners = ((ax, ay), (bx, ay), (bx, by), (ax, by))
+            for i, p in enumerate(corners):
+                q = corners[(i + 1) % 4]
+                box.vertices += [p, q]
+                box.edge_lengths += [0.0, abs(q[0] - p[0]) + abs(q[1] - p[1])]
+            box.vertices_colors = [Config.selection_box_color] * 8
+        if not bpy.app.background:
+            box.create_batch()
 
     @classmethod
     def update_residuals(cls, fb, context, headobj, keyframe):
@@ -351,37 +569,21 @@ class FBViewport:
             wire.create_batch()
             return
 
-        # ----------
-        # Projection
-        projection = fb.projection_mat(keyframe).T
-
         camobj = bpy.context.scene.camera
-        m = camobj.matrix_world.inverted()
-
-        # Fill matrix in homogeneous coords
-        vv = np.ones((len(p3d), 4), dtype=np.float32)
-        vv[:, :-1] = p3d
-
-        # Object transform, inverse camera, projection apply -> numpy
-        transform = np.array(
-            headobj.matrix_world.transposed() @ m.transposed()) @ projection
-        # Calc projection
-        vv = vv @ transform
-        vv = (vv.T / vv[:, 3]).T
-
-        verts2 = []
-        for i, v in enumerate(vv):
-            x, y = coords.frame_to_image_space(v[0], v[1], rx, ry)
-            verts2.append(coords.image_space_to_region(x, y,
-                                                       x1, y1, x2, y2))
-            wire.edge_lengths.append(0)
-            verts2.append(coords.image_space_to_region(p2d[i][0], p2d[i][1],
-                                                       x1, y1, x2, y2))
-            # length = np.linalg.norm((v[0]-p2d[i][0], v[1]-p2d[i][1]))
-            length = 22.0
-            wire.edge_lengths.append(length)
-
+        # Projected surface points interleaved with pins as line pairs
+        verts2 = np.empty((len(p3d), 2, 2), dtype=np.float64)
+        verts2[:, 0] = coords.project_to_image_space(
+            p3d, headobj.matrix_world, camobj.matrix_world,
+            fb.projection_mat(keyframe), rx, ry)
+        verts2[:, 1] = p2d
+        verts2 = coords.image_space_to_region_arr(
+            verts2, x1, y1, x2, y2).astype(np.float32).reshape((-1, 2))
+
+        # length = np.linalg.norm((v[0]-p2d[i][0], v[1]-p2d[i][1]))
+        wire.edge_lengths = np.tile(np.array((0.0, 22.0), dtype=np.float32),
+                                    len(p3d))
         wire.vertices = verts2
         wire.vertices_colors = np.full((len(verts2), 4),
-                                       Config.residual_color).tolist()
+                                       Config.residual_color,
+                                       dtype=np.float32)
         wire.create_batch()
@@ -0,0 +1,98 @@
+# -------
+# KeenTools for Blender performance benchmarks
+# Timings are only printed, correctness is checked by integration tests
+# start it from commandline:
+# blender -b -P /full_path_to/benchmarks.py
+# -------
+import time
+import sys
+import os
+
+import numpy as np
+import bpy
+
+# Import test functions used in benchmarks started from any location
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import test_utils
+
+from keentools_facebuilder.utils import coords
+from keentools_facebuilder.fbloader import FBLoader
+
+
+def _mean_time(func, repeats=1):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        func()
+    return (time.perf_counter() - start) / repeats
+
+
+def bench_builder_mesh():
+    test_utils.new_scene()
+    test_utils.create_head()
+    FBLoader.load_model(0)
+    fb = FBLoader.get_builder()
+    legacy_time = _mean_time(lambda: test_utils.legacy_builder_mesh(fb))
+    bulk_time = _mean_time(
+        lambda: FBLoader.get_builder_mesh(fb, 'bulk_mesh'))
+    print('BUILDER MESH: legacy {:.4f}s bulk {:.4f}s'.format(
+        legacy_time, bulk_time))
+
+
+def bench_coords_arr():
+    border = (12.5, -3.0, 812.25, 601.0)
+    for count in (10, 100, 1000):
+        points = np.random.RandomState(count).uniform(-0.5, 0.5, (count, 2))
+        scalar_time = _mean_time(
+            lambda: [coords.image_space_to_region(x, y, *border)
+                     for x, y in points], 100)
+        arr_time = _mean_time(
+            lambda: coords.image_space_to_region_arr(points, *border), 100)
+        print('COORDS {} points: scalar {:.5f}s array {:.5f}s'.format(
+            count, scalar_time, arr_time))
+
+
+def bench_camera_placement():
+    rng = np.random.RandomState(3)
+    model_mats = []
+    for i in range(50):
+        q, _ = np.linalg.qr(rng.randn(3, 3))
+        mat = np.eye(4)
+        mat[:3, :3] = q
+        mat[3, :3] = rng.uniform(-10.0, 10.0, 3)
+        model_mats.append(mat)
+    head_mat = np.diag((1.5, 1.5, 1.5, 1.0))
+    single_time = _mean_time(
+        lambda: [coords.calc_model_mat(m, head_mat) for m in model_mats], 10)
+    batch_time = _mean_time(
+        lambda: coords.calc_model_mats(model_mats, head_mat), 10)
+    print('CAMERA PLACEMENT 50 views: single {:.5f}s batch {:.5f}s'.format(
+        single_time, batch_time))
+
+
+def bench_pin_hover():
+    vp = FBLoader.viewport()
+    pins = vp.pins()
+    rng = np.random.RandomState(19)
+    pins.set_pins(rng.uniform(-0.5, 0.5, (500, 2)))
+    pins.reset_current_pin()
+    border = coords.get_camera_border(bpy.context)
+    vp.update_view_relative_pixel_size(bpy.context)
+    mouse = [coords.image_space_to_region(x, y, *border)
+             for x, y in rng.uniform(-0.5, 0.5, (250, 2))]
+
+    def _hover():
+        for mx, my in mouse:
+            vp.update_hover(bpy.context, mx, my)
+
+    hover_time = _mean_time(_hover) / len(mouse)
+    print('PIN HOVER 500 pins: {:.6f}s per event'.format(hover_time))
+    pins.set_pins([])
+
+
+BENCHMARKS = (bench_builder_mesh, bench_coords_arr, bench_camera_placement,
+              bench_pin_hover)
+
+
+if __name__ == "__main__":
+    for bench in BENCHMARKS:
+        bench()
@@ -5,7 +5,10 @@
 # -------
 import unittest
 
+import tempfile
+
 import bpy
+import numpy as np
 import sys
 import os
 
@@ -15,9 +18,21 @@ import test_utils
 # import tests.test_utils as test_utils
 
 
-from keentools_facebuilder.utils import coords, materials
+from keentools_facebuilder.utils import coords, materials, manipulate, \
+    meshes, export
 from keentools_facebuilder.config import Config, get_main_settings, \
-    get_operators
+    get_operators, BuilderType
+from keentools_facebuilder.fbloader import FBLoader
+from keentools_facebuilder.utils.meshes import FBMeshTopologyCache, \
+    FBMeshGeomUpdater
+from keentools_facebuilder.utils.expressions import FBExpressionCache
+from keentools_facebuilder.utils.spatial import FBPointGrid
+from keentools_facebuilder.viewport import FBScreenPins
+from keentools_facebuilder.utils.fake_context import get_fake_context
+from keentools_facebuilder.utils.pincache import FBPinCache
+from keentools_facebuilder.utils.projected import FBProjectedVertices
+from keentools_facebuilder.utils.redraw import FBRedrawScheduler
+from keentools_facebuilder.utils.edges import FBEdgeShader3D, edges_mask
 
 
 class FaceBuilderTest(unittest.TestCase):
@@ -159,6 +174,725 @@ class FaceBuilderTest(unittest.TestCase):
         tex_name = materials.bake_tex(headnum=0, tex_name='bake_texture_name')
         self.assertTrue(tex_name is not None)
 
+    def test_builder_mesh_construction(self):
+        test_utils.new_scene()
+        test_utils.create_head()
+        FBLoader.load_model(0)
+        fb = FBLoader.get_builder()
+
+        legacy = test_utils.legacy_builder_mesh(fb)
+        mesh = FBLoader.get_builder_mesh(fb, 'bulk_mesh')
+        for a, b in zip(test_utils.mesh_arrays(legacy),
+                        test_utils.mesh_arrays(mesh)):
+            self.assertEqual(a.shape, b.shape)
+            self.assertTrue(np.allclose(a, b))
+
+    def test_topology_cache(self):
+        test_utils.new_scene()
+        test_utils.create_head()
+        settings = get_main_settings()
+        head = settings.get_head(0)
+        mesh = head.headobj.data
+        full_faces = len(mesh.polygons)
+        FBMeshTopologyCache.invalidate()
+        FBMeshTopologyCache.reset_counters()
+        head.check_ears = False  # masked and full topology misses
+        self.assertTrue(head.headobj.data is mesh)
+        no_ears_faces = len(mesh.polygons)
+        self.assertLess(no_ears_faces, full_faces)
+        head.check_ears = True
+        self.assertEqual(full_faces, len(mesh.polygons))
+        head.check_ears = False
+        self.assertEqual(no_ears_faces, len(mesh.polygons))
+        # every UV set is a separate cache entry
+        uv_count = len(Config.uv_sets)
+        self.assertEqual(2 * uv_count, FBMeshTopologyCache.misses())
+        self.assertEqual(2 * uv_count, FBMeshTopologyCache.hits())
+
+    def test_topology_cache_checks_model(self):
+        test_utils.new_scene()
+        test_utils.create_head()
+        head = get_main_settings().get_head(0)
+        FBLoader.load_model(0)
+        fb = FBLoader.get_builder()
+        FBMeshTopologyCache.invalidate()
+        face_sizes, face_indices, uvs = FBLoader.get_builder_topology(
+            fb, builder_version=head.mod_ver)
+        points_count = len(fb.applied_args_vertices())
+        self.assertLess(face_indices.max(), points_count)
+
+        # Topology of another model stored under the same key
+        key = FBMeshTopologyCache.make_key(
+            FBLoader.get_builder_type(),
+            FBLoader._model_version(FBLoader.get_builder_type(),
+                                    head.mod_ver))
+        FBMeshTopologyCache.put(key, face_sizes.copy(),
+                                face_indices + points_count, uvs.copy())
+        # Cache hits are checked against vertices of the mesh being built
+        _, _, checked, _ = FBLoader.get_builder_arrays(
+            fb, builder_version=head.mod_ver)
+        self.assertTrue(np.array_equal(face_indices, checked))
+
+    def test_uv_layer_switching(self):
+        test_utils.new_scene()
+        test_utils.create_head()
+        settings = get_main_settings()
+        head = settings.get_head(0)
+        mesh = head.headobj.data
+        self.assertEqual([name for _, name in Config.uv_sets],
+                         [layer.name for layer in mesh.uv_layers])
+        for uv_set, name in Config.uv_sets:
+            head.tex_uv_shape = uv_set
+            self.assertTrue(head.headobj.data is mesh)
+            self.assertEqual(name, mesh.uv_layers.active.name)
+            self.assertTrue(mesh.uv_layers[name].active_render)
+
+    def test_mask_subset_matches_builder(self):
+        test_utils.new_scene()
+        test_utils.create_head()
+        settings = get_main_settings()
+        head = settings.get_head(0)
+        head.check_eyes = False
+        head.check_nose = False
+        _, loops, totals, _, _ = test_utils.mesh_arrays(head.headobj.data)
+        FBLoader.load_model(0)
+        builder = FBLoader.get_builder()
+        for i, m in enumerate(head.get_masks()):
+            builder.set_mask(i, m)
+        legacy = test_utils.legacy_builder_mesh(builder, 'legacy_mask_mesh')
+        _, l_loops, l_totals, _, _ = test_utils.mesh_arrays(legacy)
+        self.assertEqual(len(l_totals), len(totals))
+        self.assertEqual(sorted(map(tuple, np.split(
+            l_loops, np.cumsum(l_totals)[:-1]))), sorted(map(tuple, np.split(
+                loops, np.cumsum(totals)[:-1]))))
+
+    def test_exact_normals(self):
+        test_utils.new_scene()
+        test_utils.create_head()
+        settings = get_main_settings()
+        head = settings.get_head(0)
+        mesh = head.headobj.data
+        head.exact_normals = True
+        self.assertTrue(mesh.use_auto_smooth)
+        self.assertTrue(mesh.has_custom_normals)
+        FBLoader.load_model(0)
+        normals = FBLoader.get_builder_normals(FBLoader.get_builder())
+        mesh.calc_normals_split()
+        loop_normals = np.empty(len(mesh.loops) * 3, dtype=np.float32)
+        mesh.loops.foreach_get('normal', loop_normals)
+        _, loops, _, _, _ = test_utils.mesh_arrays(mesh)
+        self.assertTrue(np.allclose(loop_normals.reshape((-1, 3)),
+                                    normals[loops], atol=1e-3))
+        head.exact_normals = False
+        self.assertFalse(mesh.use_auto_smooth)
+
+        # Auto smooth set by user is kept
+        mesh.use_auto_smooth = True
+        mesh.auto_smooth_angle = 0.5
+        FBLoader.update_exact_normals(head)
+        self.assertTrue(mesh.use_auto_smooth)
+        head.exact_normals = True
+        head.exact_normals = False
+        self.assertTrue(mesh.use_auto_smooth)
+        self.assertAlmostEqual(0.5, mesh.auto_smooth_angle, places=5)
+
+    def test_expression_cache(self):
+        test_utils.new_scene()
+        self._head_cams_and_pins()
+        settings = get_main_settings()
+        headnum = settings.get_last_headnum()
+        head = settings.get_head(headnum)
+        head.use_emotions = True
+        kid = head.get_keyframe(settings.get_last_camnum(headnum))
+        FBLoader.load_model(headnum)
+        fb = FBLoader.get_builder()
+        verts = FBExpressionCache.get_vertices(fb, kid)
+        self.assertTrue(np.allclose(
+            verts, meshes.builder_to_blender_coords(
+                fb.applied_args_model_vertices_at(kid))))
+        FBExpressionCache.reset_counters()
+        manipulate.push_neutral_head_in_undo_history(head, kid)
+        FBLoader.load_model(headnum)  # the same serial keeps cache
+        coords.update_head_mesh_emotions(fb, head.headobj, kid)
+        # only neutral vertices may be requested from builder
+        self.assertEqual(2, FBExpressionCache.hits())
+        self.assertTrue(FBExpressionCache.misses() <= 1)
+
+        FBExpressionCache.set_max_bytes(verts.nbytes)
+        coords.update_head_mesh_neutral(fb, head.headobj)
+        self.assertEqual(verts.nbytes, FBExpressionCache.cached_bytes())
+        FBExpressionCache.set_max_bytes(Config.expression_cache_max_bytes)
+
+    def test_expressions_to_shape_keys(self):
+        test_utils.new_scene()
+        self._head_cams_and_pins()
+        settings = get_main_settings()
+        headnum = settings.get_last_headnum()
+        head = settings.get_head(headnum)
+        head.use_emotions = True
+        op = getattr(get_operators(), Config.fb_export_expressions_callname)
+        op('EXEC_DEFAULT', headnum=headnum)
+        # Head mesh stays without shape keys
+        self.assertIsNone(head.headobj.data.shape_keys)
+        obj = manipulate.expressions_object(head.headobj)
+        self.assertIsNot(obj.data, head.headobj.data)
+        key_blocks = obj.data.shape_keys.key_blocks
+        self.assertEqual(len(head.cameras) + 1, len(key_blocks))
+        self.assertEqual(Config.neutral_shape_key_name, key_blocks[0].name)
+        # Second export reuses existing copy and shape keys
+        objects_count = len(bpy.data.objects)
+        op('EXEC_DEFAULT', headnum=headnum)
+        self.assertEqual(objects_count, len(bpy.data.objects))
+        self.assertEqual(len(head.cameras) + 1, len(key_blocks))
+
+    def test_geom_updater_skips_same_vertices(self):
+        test_utils.new_scene()
+        test_utils.create_head()
+        settings = get_main_settings()
+        head = settings.get_head(0)
+        mesh = head.headobj.data
+        FBLoader.load_model(0)
+        geom = FBLoader.get_builder().applied_args_vertices()
+        self.assertTrue(FBMeshGeomUpdater.set_builder_vertices(mesh, geom))
+        version = FBMeshGeomUpdater.version(mesh)
+        self.assertFalse(FBMeshGeomUpdater.set_builder_vertices(mesh, geom))
+        self.assertEqual(version, FBMeshGeomUpdater.version(mesh))
+
+        verts, _, _, _, _ = test_utils.mesh_arrays(mesh)
+        rot = np.array([[1., 0., 0.], [0., 0., 1.], [0., -1., 0]])
+        self.assertTrue(np.allclose(verts.reshape((-1, 3)), geom @ rot))
+
+        moved = np.array(geom) + 0.1
+        self.assertTrue(FBMeshGeomUpdater.set_builder_vertices(mesh, moved))
+        self.assertEqual(version + 1, FBMeshGeomUpdater.version(mesh))
+        FBMeshGeomUpdater.invalidate(mesh)
+        self.assertTrue(FBMeshGeomUpdater.set_builder_vertices(mesh, moved))
+
+        # States of removed meshes are dropped by load/undo handlers
+        tmp = bpy.data.meshes.new('geom_updater_tmp')
+        tmp.vertices.add(3)
+        FBMeshGeomUpdater.set_vertices(tmp, np.ones((3, 3)))
+        self.assertNotEqual(0, FBMeshGeomUpdater.version(tmp))
+        pointer = tmp.as_pointer()
+        bpy.data.meshes.remove(tmp)
+        FBMeshGeomUpdater.prune()
+        self.assertFalse(any(k[0] == pointer
+                             for k in FBMeshGeomUpdater._meshes))
+        self.assertNotEqual(0, FBMeshGeomUpdater.version(mesh))
+        FBMeshGeomUpdater.forget(mesh)
+        self.assertEqual(0, FBMeshGeomUpdater.version(mesh))
+
+    def test_direct_head_export(self):
+        test_utils.new_scene()
+        test_utils.create_head()
+        settings = get_main_settings()
+        mesh = settings.get_head(0).headobj.data
+        outdir = tempfile.mkdtemp()
+        for ext in ('obj', 'ply', 'glb'):
+            filepath = os.path.join(outdir, 'head.' + ext)
+            self.assertTrue(export.export_head(0, filepath))
+            self.assertTrue(os.path.getsize(filepath) > 0)
+
+        with open(os.path.join(outdir, 'head.obj')) as f:
+            v_count = sum(1 for line in f if line.startswith('v '))
+        self.assertEqual(len(mesh.vertices), v_count)
+        with open(os.path.join(outdir, 'head.glb'), 'rb') as f:
+            self.assertEqual(b'glTF', f.read(4))
+
+    def test_ply_export_links_texture(self):
+        verts = np.array([(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0)],
+                         dtype=np.float32)
+        face_sizes = np.array([4], dtype=np.int32)
+        face_indices = np.arange(4, dtype=np.int32)
+        uvs = verts[:, :2].copy()
+        outdir = tempfile.mkdtemp()
+        filepath = os.path.join(outdir, 'textured.ply')
+        export.export_arrays(filepath, verts, face_sizes, face_indices, uvs,
+                             np.ones((2, 2, 4), dtype=np.float32))
+        with open(filepath, 'rb') as f:
+            header = f.read().split(b'end_header\n')[0].decode('ascii')
+        self.assertIn('comment TextureFile textured.png\n', header)
+        self.assertTrue(os.path.exists(os.path.join(outdir, 'textured.png')))
+
+        export.export_arrays(filepath, verts, face_sizes, face_indices, uvs)
+        with open(filepath, 'rb') as f:
+            self.assertNotIn(b'TextureFile', f.read().split(b'end_header')[0])
+
+    def test_pin_grid_matches_linear_scan(self):
+        rng = np.random.RandomState(7)
+        points = [tuple(p) for p in rng.uniform(-0.5, 0.5, (500, 2))]
+        points.append(points[10])  # duplicate pin goes to the lowest index
+        grid = FBPointGrid()
+        grid.build(points, 0.02)
+        grid.move(3, (0.1, 0.1))
+        points[3] = (0.1, 0.1)
+        grid.add((0.3, -0.2))
+        points.append((0.3, -0.2))
+        grid.remove(5)
+        del points[5]
+        for x, y in rng.uniform(-0.5, 0.5, (200, 2)):
+            for tolerance2 in (0.0001, 0.001, 0.04):
+                nearest, dist2 = coords.nearest_point(x, y, points)
+                expected = nearest if dist2 < tolerance2 else -1
+                self.assertEqual(expected,
+                                 grid.nearest(x, y, tolerance2)[0])
+                self.assertEqual(
+                    [i for i, p in enumerate(points)
+                     if (x - p[0]) ** 2 + (y - p[1]) ** 2 < tolerance2],
+                    grid.in_radius(x, y, tolerance2))
+        self.assertEqual(9, grid.nearest(*points[9], 0.0001)[0])
+
+    def test_screen_pins_storage(self):
+        pins = FBScreenPins()
+        pins.set_pins([(0.0, 0.0), (0.1, 0.1)])
+        for i in range(40):
+            pins.add_pin((0.01 * i, -0.01 * i))
+        self.assertEqual(42, pins.count())
+        pins.move_pin(1, (0.2, 0.3))
+        self.assertTrue(np.allclose(pins.arr()[1], (0.2, 0.3)))
+        pins.set_selected(2)
+        pins.remove_pin(0)  # order is kept
+        self.assertTrue(np.allclose(pins.arr()[0], (0.2, 0.3)))
+        self.assertEqual([1], pins.selected_indices().tolist())
+        last = tuple(pins.arr()[-1])
+        pins.swap_remove(0)
+        self.assertEqual(40, pins.count())
+        self.assertTrue(np.allclose(pins.arr()[0], last))
+        self.assertEqual(0, pins.nearest_pin(last[0], last[1], 1e-6)[0])
+        for i, p in enumerate(pins.arr()):
+            self.assertEqual(i, pins.nearest_pin(p[0], p[1], 1e-6)[0])
+
+        region = pins.to_region(10, 20, 110, 80)
+        for p, r in zip(pins.arr(), region):
+            self.assertTrue(np.allclose(
+                r, coords.image_space_to_region(p[0], p[1], 10, 20, 110, 80),
+                atol=1e-4))
+        pins.set_pins([])
+        self.assertEqual(0, pins.count())
+
+    def test_batched_surface_points(self):
+        test_utils.new_scene()
+        self._head_cams_and_pins()
+        settings = get_main_settings()
+        headnum = settings.get_last_headnum()
+        head = settings.get_head(headnum)
+        FBLoader.load_model(headnum)
+        fb = FBLoader.get_builder()
+        expected = [coords.pin_to_xyz(fb.pin(k, i), head.headobj)
+                    for k in fb.keyframes() for i in range(fb.pins_count(k))]
+        verts, colors = FBLoader.viewport().surface_points(
+            fb, head.headobj)
+        self.assertEqual(np.float32, verts.dtype)
+        self.assertEqual(len(expected), len(verts))
+        self.assertEqual(len(expected), len(colors))
+        self.assertTrue(np.allclose(np.array(expected), verts, atol=1e-5))
+
+    def test_coords_arr_match_scalar(self):
+        rng = np.random.RandomState(11)
+        points = rng.uniform(-1000.0, 1000.0, (100, 2))
+        border = (12.5, -3.0, 812.25, 601.0)
+        w, h = coords.render_frame()
+        pairs = [
+            (coords.image_space_to_frame_arr(points),
+             lambda x, y: coords.image_space_to_frame(x, y)),
+            (coords.frame_to_image_space_arr(points, 1920, 1080),
+             lambda x, y: coords.frame_to_image_space(x, y, 1920, 1080)),
+            (coords.image_space_to_region_arr(points, *border),
+             lambda x, y: coords.image_space_to_region(x, y, *border)),
+            (coords.region_to_image_space_arr(points, *border),
+             lambda x, y: coords.region_to_image_space(x, y, *border)),
+            (coords.region_to_image_space_arr(points, 5, 5, 5, 5),
+             lambda x, y: coords.region_to_image_space(x, y, 5, 5, 5, 5))]
+        for res, func in pairs:
+            self.assertEqual(points.shape, res.shape)
+            self.assertTrue(np.array_equal(
+                np.array([func(x, y) for x, y in points]), res))
+        # Broadcasting over leading axes and single points
+        res = coords.image_space_to_region_arr(
+            points.reshape((25, 2, 2)), *border)
+        self.assertTrue(np.array_equal(
+            coords.image_space_to_region_arr(points, *border),
+            res.reshape((-1, 2))))
+        self.assertEqual(coords.image_space_to_region(0.1, 0.2, *border),
+                         tuple(coords.image_space_to_region_arr(
+                             (0.1, 0.2), *border)))
+        self.assertEqual(w, coords.image_space_to_frame_arr((0.5, 0.0))[0])
+
+    def test_coords_arr_sizes(self):
+        border = (12.5, -3.0, 812.25, 601.0)
+        for count in (10, 100, 1000):
+            points = np.random.RandomState(count).uniform(-0.5, 0.5,
+                                                          (count, 2))
+            expected = [coords.image_space_to_region(x, y, *border)
+                        for x, y in points]
+            self.assertTrue(np.array_equal(
+                np.array(expected),
+                coords.image_space_to_region_arr(points, *border)))
+
+    def test_camera_border_cache(self):
+        render = bpy.context.scene.render
+        rx = render.resolution_x
+        coords.FBCameraBorder.invalidate()
+        coords.FBCameraBorder.reset_counters()
+        border = coords.get_camera_border(bpy.context)
+        version = coords.FBCameraBorder.version()
+        self.assertEqual(border, coords.get_camera_border(bpy.context))
+        self.assertEqual(version, coords.FBCameraBorder.version())
+        self.assertEqual(1, coords.FBCameraBorder.misses())
+        self.assertEqual(1, coords.FBCameraBorder.hits())
+
+        render.resolution_x = rx * 2
+        other = coords.get_camera_border(bpy.context)
+        self.assertNotEqual(border, other)
+        self.assertEqual(version + 1, coords.FBCameraBorder.version())
+        self.assertEqual(other, coords.calc_camera_border(
+            *coords.FBCameraBorder.make_key(get_fake_context())))
+
+        render.resolution_x = rx
+        self.assertEqual(border, coords.get_camera_border(bpy.context))
+        self.assertEqual(version + 2, coords.FBCameraBorder.version())
+        self.assertEqual(2, coords.FBCameraBorder.hits())
+
+    def test_batched_camera_placement(self):
+        rng = np.random.RandomState(3)
+        model_mats = []
+        for i in range(50):
+            q, _ = np.linalg.qr(rng.randn(3, 3))
+            mat = np.eye(4)
+            mat[:3, :3] = q
+            mat[3, :3] = rng.uniform(-10.0, 10.0, 3)
+            model_mats.append(mat)
+        model_mats.append(np.diag((2.0, 2.0, 2.0, 1.0)))  # not rigid
+        model_mats.append(np.zeros((4, 4)))  # singular
+        head_mat = np.diag((1.5, 1.5, 1.5, 1.0))
+        head_mat[:3, 3] = (0.1, 0.2, 0.3)
+
+        mats, valid = coords.calc_model_mats(model_mats, head_mat)
+        for mat, ok, model_mat in zip(mats, valid, model_mats):
+            expected = coords.calc_model_mat(model_mat, head_mat)
+            self.assertEqual(expected is not None, ok)
+            if ok:
+                self.assertTrue(np.allclose(expected, mat, atol=1e-9))
+
+        test_utils.new_scene()
+        self._head_cams_and_pins()
+        settings = get_main_settings()
+        headnum = settings.get_last_headnum()
+        head = settings.get_head(headnum)
+        FBLoader.load_model(headnum)
+        FBLoader.update_all_camera_positions(headnum)
+        fb = FBLoader.get_builder()
+        for cam in head.cameras:
+            if not cam.has_pins():
+                continue
+            expected = coords.calc_model_mat(
+                fb.model_mat(cam.get_keyframe()), head.headobj.matrix_world)
+            self.assertTrue(np.allclose(
+                expected, np.array(cam.camobj.matrix_world), atol=1e-5))
+
+    def test_pin_cache(self):
+        test_utils.new_scene()
+        self._head_cams_and_pins()
+        settings = get_main_settings()
+        headnum = settings.get_last_headnum()
+        camnum = settings.get_last_camnum(headnum)
+        head = settings.get_head(headnum)
+        FBLoader.load_model(headnum)
+        fb = FBLoader.get_builder()
+        kid = settings.get_keyframe(headnum, camnum)
+        count = fb.pins_count(kid)
+
+        FBPinCache.invalidate()
+        FBPinCache.reset_counters()
+        vp = FBLoader.viewport()
+        for _ in range(3):
+            vp.img_points(fb, kid)
+            vp.surface_points_only(fb, head.headobj, kid)
+            FBLoader.update_pins_count(headnum, camnum)
+        self.assertEqual(count + 1, FBPinCache.native_calls())
+        self.assertEqual(8, FBPinCache.hits())
+
+        img_pos = FBPinCache.img_pos(fb, kid)
+        geo_idxs, weights = FBPinCache.attachments(fb, kid)
+        for i in range(count):
+            pin = fb.pin(kid, i)
+            self.assertEqual(tuple(pin.img_pos), tuple(img_pos[i]))
+            sp = pin.surface_point
+            self.assertEqual(list(sp.geo_point_idxs[:3]), list(geo_idxs[i]))
+            self.assertTrue(np.allclose(sp.barycentric_coordinates[:3],
+                                        weights[i]))
+
+        # Same state deserialization keeps the cache
+        FBLoader.deserialize(head.get_serial_str())
+        FBPinCache.img_pos(fb, kid)
+        self.assertEqual(count + 1, FBPinCache.native_calls())
+
+        FBLoader.move_pin(kid, 0, (10.0, 20.0))
+        self.assertEqual((10.0, 20.0), tuple(FBPinCache.img_pos(fb, kid)[0]))
+        FBLoader.remove_pin(kid, 0)
+        self.assertEqual(count - 1, FBPinCache.pins_count(fb, kid))
+        FBLoader.remove_pins(kid)
+        self.assertEqual(0, FBPinCache.pins_count(fb, kid))
+
+    def test_projected_vertices(self):
+        test_utils.new_scene()
+        self._head_cams_and_pins()
+        settings = get_main_settings()
+        headnum = settings.get_last_headnum()
+        camnum = settings.get_last_camnum(headnum)
+        head = settings.get_head(headnum)
+        camobj = head.get_camera(camnum).camobj
+        FBLoader.load_model(headnum)
+        FBLoader.place_camera(headnum, camnum)
+        fb = FBLoader.get_builder()
+        kid = settings.get_keyframe(headnum, camnum)
+
+        FBProjectedVertices.invalidate()
+        FBProjectedVertices.reset_counters()
+        points, _ = FBProjectedVertices.get(fb, head.headobj, camobj, kid)
+        FBProjectedVertices.get(fb, head.headobj, camobj, kid)
+        self.assertEqual(1, FBProjectedVertices.builds())
+        self.assertEqual((len(head.headobj.data.vertices), 2), points.shape)
+
+        # Surface point of pin projects close to the pin after solve
+        p3d = FBLoader.viewport().surface_points_only(fb, head.headobj, kid)
+        p2d = FBLoader.viewport().img_points(fb, kid)
+        projected = coords.project_to_image_space(
+            p3d, head.headobj.matrix_world, camobj.matrix_world,
+            fb.projection_mat(kid), *coords.render_frame())
+        self.assertTrue(np.allclose(projected, p2d, atol=0.05))
+
+        dist2 = 0.0004
+        for x, y in p2d:
+            d2 = ((points - (x, y)) ** 2).sum(axis=1)
+            expected = int(np.argmin(d2))
+            idx, pos = FBProjectedVertices.nearest(
+                fb, head.headobj, camobj, kid, x, y, dist2)
+            self.assertEqual(expected if d2[expected] < dist2 else -1, idx)
+            if idx >= 0:
+                self.assertEqual(tuple(points[idx].tolist()), pos)
+
+        FBLoader.solve(headnum, camnum)
+        FBProjectedVertices.get(fb, head.headobj, camobj, kid)
+        self.assertEqual(2, FBProjectedVertices.builds())
+
+        # Focal change updates projection without explicit invalidation
+        camera = head.get_camera(camnum)
+        camera.focal = camera.focal * 1.5
+        FBProjectedVertices.get(fb, head.headobj, camobj, kid)
+        self.assertEqual(3, FBProjectedVertices.builds())
+
+    def test_pin_hover(self):
+        vp = FBLoader.viewport()
+        pins = vp.pins()
+        rng = np.random.RandomState(19)
+        pins.set_pins(rng.uniform(-0.5, 0.5, (500, 2)))
+        pins.reset_current_pin()
+        border = coords.get_camera_border(bpy.context)
+        vp.update_view_relative_pixel_size(bpy.context)
+        tolerance2 = vp.tolerance_dist2()
+
+        mouse = [coords.image_space_to_region(x, y, *border)
+                 for x, y in rng.uniform(-0.5, 0.5, (200, 2))]
+        mouse += [coords.image_space_to_region(x, y, *border)
+                  for x, y in pins.arr()[:50].tolist()]
+        for mx, my in mouse:
+            vp.update_hover(bpy.context, mx, my)
+            x, y = coords.region_to_image_space(mx, my, *border)
+            nearest, dist2 = coords.nearest_point(x, y, pins.arr().tolist())
+            self.assertEqual(nearest if dist2 < tolerance2 else -1,
+                             pins.hover_pin())
+
+        self.assertFalse(vp.update_hover(bpy.context, *mouse[-1]))
+        pins.remove_pin(0)
+        self.assertEqual(-1, pins.hover_pin())
+
+    def test_pin_selection_and_group_drag(self):
+        test_utils.new_scene()
+        self._head_cams_and_pins()
+        settings = get_main_settings()
+        headnum = settings.get_last_headnum()
+        camnum = settings.get_last_camnum(headnum)
+        kid = settings.get_keyframe(headnum, camnum)
+        FBLoader.load_model(headnum)
+        FBLoader.load_pins(headnum, camnum)
+        fb = FBLoader.get_builder()
+        pins = FBLoader.viewport().pins()
+
+        self.assertEqual([0, 1, 2, 3], pins.select_in_rect(
+            -1.0, -1.0, 1.0, 1.0).tolist())
+        self.assertEqual([], pins.select_in_rect(2.0, 2.0, 3.0, 3.0).tolist())
+        self.assertEqual(0, len(pins.selected_indices()))
+        pins.clear_selection()
+        pins.toggle_selected(0)
+        pins.toggle_selected(1)
+        self.assertEqual([0, 1], pins.selected_indices().tolist())
+
+        before = np.array(FBPinCache.img_pos(fb, kid))
+        border = coords.get_camera_border(bpy.context)
+        x, y = pins.arr()[0].tolist()
+        start = coords.image_space_to_region(x, y, *border)
+        end = coords.image_space_to_region(x + 0.02, y - 0.01, *border)
+        op = getattr(get_operators(), Config.fb_movepin_callname)
+        op('EXEC_DEFAULT', headnum=headnum, camnum=camnum,
+           pinx=start[0], piny=start[1], test_action="add_pin")
+        # Selection survives pins reload on click
+        self.assertEqual([0, 1], pins.selected_indices().tolist())
+        op('EXEC_DEFAULT', headnum=headnum, camnum=camnum,
+           pinx=end[0], piny=end[1], test_action="mouse_move")
+        op('EXEC_DEFAULT', headnum=headnum, camnum=camnum,
+           pinx=end[0], piny=end[1], test_action="mouse_release")
+
+        after = np.array(FBPinCache.img_pos(fb, kid))
+        self.assertEqual(len(before), len(after))
+        offset = after[0] - before[0]
+        self.assertTrue(np.allclose(after[1] - before[1], offset, atol=1e-3))
+        self.assertTrue(np.allclose(after[2:], before[2:]))
+        self.assertTrue(np.abs(offset).max() > 1.0)
+        test_utils.out_pinmode()
+
+    def test_redraw_scheduler(self):
+        scheduler = FBRedrawScheduler
+        scheduler.mark_all_dirty()
+        scheduler.reset_counters()
+        inputs = {'pins': 1, 'solve': 1, 'border': 1, 'mesh': 1}
+        scheduler.check_inputs(**inputs)
+        for batch in ('pins2d', 'residuals'):
+            self.assertTrue(scheduler.need_rebuild(batch))
+            scheduler.rebuilt(batch)
+        self.assertTrue(scheduler.is_idle())
+
+        # Idle timer events
+        for _ in range(100):
+            scheduler.check_inputs(**inputs)
+            self.assertTrue(scheduler.is_idle())
+
+        scheduler.check_inputs(**dict(inputs, mesh=2))
+        self.assertFalse(scheduler.need_rebuild('pins2d'))
+        self.assertTrue(scheduler.need_rebuild('residuals'))
+        scheduler.rebuilt('residuals')
+
+        scheduler.mark_dirty('colors')
+        self.assertTrue(scheduler.need_rebuild('pins2d'))
+        self.assertFalse(scheduler.need_rebuild('residuals'))
+        scheduler.rebuilt('pins2d')
+
+        scheduler.check_inputs(**dict(inputs, mesh=2, pins=2))
+        self.assertTrue(scheduler.need_rebuild('pins2d'))
+        self.assertTrue(scheduler.need_rebuild('residuals'))
+
+        self.assertEqual(2, scheduler.rebuilds('pins2d'))
+        self.assertEqual(2, scheduler.rebuilds('residuals'))
+        rates = scheduler.rebuilds_per_second()
+        self.assertTrue(rates['pins2d'] > 0)
+
+    def test_wireframe_topology_cache(self):
+        test_utils.new_scene()
+        test_utils.create_head()
+        settings = get_main_settings()
+        head = settings.get_head(0)
+        headobj = head.headobj
+        headobj.location = (1.0, 2.0, 3.0)
+        bpy.context.view_layer.update()
+
+        wireframer = FBEdgeShader3D()
+        wireframer.init_geom_data(headobj)
+        self.assertEqual(1, wireframer.topology_builds)
+        # Pin drag events only read vertex positions
+        for _ in range(10):
+            wireframer.init_geom_data(headobj)
+        self.assertEqual(1, wireframer.topology_builds)
+
+        verts, _, _, edges, _ = test_utils.mesh_arrays(headobj.data)
+        m = np.array(headobj.matrix_world)
+        verts = verts @ m[:3, :3].T + m[:3, 3]
+        self.assertTrue(np.allclose(wireframer.vertices, verts, atol=1e-5))
+        self.assertTrue(np.allclose(wireframer.edges_vertices,
+                                    verts[edges.ravel()], atol=1e-5))
+
+        wireframer.init_geom_data(headobj, ((False,), 'uv1'))
+        self.assertEqual(2, wireframer.topology_builds)
+        wireframer.invalidate_topology()
+        wireframer.init_geom_data(headobj)
+        self.assertEqual(3, wireframer.topology_builds)
+
+    def test_special_edges_mask(self):
+        test_utils.new_scene()
+        test_utils.create_head()
+        headobj = get_main_settings().get_head(0).headobj
+        vp = FBLoader.viewport()
+        pairs = vp.get_special_indices(BuilderType.FaceBuilder)
+        self.assertIs(pairs, vp.get_special_indices(BuilderType.FaceBuilder))
+
+        pair_set = set(map(tuple, pairs.tolist()))
+        _, _, _, edges, _ = test_utils.mesh_arrays(headobj.data)
+        expected = np.array([(a, b) in pair_set or (b, a) in pair_set
+                             for a, b in edges.tolist()])
+        self.assertTrue(np.array_equal(expected, edges_mask(edges, pairs)))
+
+        wireframer = FBEdgeShader3D()
+        wireframer.init_geom_data(headobj)
+        mask = wireframer.special_edges(headobj.data, pairs)
+        self.assertTrue(np.array_equal(expected, mask))
+        self.assertIs(mask, wireframer.special_edges(headobj.data, pairs))
+
+        wireframer.init_special_areas(headobj.data, pairs)
+        flags = wireframer.edges_special.reshape((-1, 2))
+        self.assertTrue(np.all(flags[expected] == 1))
+        self.assertTrue(np.all(flags[~expected] == 0))
+
+    def test_wireframe_color_uniforms(self):
+        test_utils.new_scene()
+        test_utils.create_head()
+        settings = get_main_settings()
+        headobj = settings.get_head(0).headobj
+        vp = FBLoader.viewport()
+        wireframer = vp.wireframer()
+        wireframer.init_geom_data(headobj)
+        vp.update_wireframe(FBLoader.get_builder_type(), headobj)
+        flags = wireframer.edges_special
+        builds = wireframer.topology_builds
+
+        test_utils.wireframe_coloring('wireframe_red')
+        self.assertTrue(np.allclose(wireframer.color, Config.red_scheme1))
+        self.assertTrue(np.allclose(wireframer.special_color,
+                                    Config.red_scheme2))
+        settings.show_specials = False
+        self.assertTrue(np.allclose(wireframer.special_color,
+                                    Config.red_scheme1))
+        settings.show_specials = True
+        settings.wireframe_opacity = 0.5
+        self.assertAlmostEqual(settings.overall_opacity * 0.5,
+                               wireframer.opacity, places=5)
+
+        # No CPU side buffers are rebuilt
+        self.assertIs(flags, wireframer.edges_special)
+        self.assertEqual(builds, wireframer.topology_builds)
+
+    def test_head_from_template_mesh(self):
+        test_utils.new_scene()
+        test_utils.create_head()
+        test_utils.create_head()
+        settings = get_main_settings()
+        template = FBLoader.get_template_mesh(Config.default_builder)
+        self.assertTrue(template.use_fake_user)
+        mesh1 = settings.get_head(0).headobj.data
+        mesh2 = settings.get_head(1).headobj.data
+        self.assertFalse(mesh1 is mesh2)
+        self.assertFalse(mesh1.use_fake_user)
+        self.assertEqual(len(template.vertices), len(mesh2.vertices))
+
+    def test_new_head_gets_fresh_builder(self):
+        test_utils.new_scene()
+        self._head_cams_and_pins()
+        settings = get_main_settings()
+        headnum = settings.get_last_headnum()
+        kid = settings.get_keyframe(headnum, 0)
+        FBLoader.load_model(headnum)
+        self.assertTrue(FBLoader.get_builder().is_key_at(kid))
+        test_utils.create_head()
+        self.assertFalse(FBLoader.get_builder().is_key_at(kid))
+
 
 if __name__ == "__main__":
     # unittest.main()  # -- Doesn't work with Blender, so we use Suite
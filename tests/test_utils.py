@@ -1,4 +1,6 @@
 import bpy
+import numpy as np
+
 import keentools_facebuilder
 from keentools_facebuilder.config import Config, get_main_settings, \
     get_operators
@@ -86,3 +88,53 @@ def new_scene():
 
 def save_scene(filepath):
     bpy.ops.wm.save_mainfile(filepath=filepath, check_existing=False)
+
+
+# --------------
+# Reference implementations
+def legacy_builder_mesh(builder, mesh_name='legacy_mesh'):
+    """ Per-element mesh construction used before bulk foreach_set """
+    geo = builder.applied_args_model()
+    me = geo.mesh(0)
+
+    vertices = []
+    for i in range(0, me.points_count()):
+        vertices.append(me.point(i))
+
+    rot = np.array([[1., 0., 0.], [0., 0., 1.], [0., -1., 0]])
+    vertices2 = vertices @ rot
+
+    faces = []
+    for i in range(0, me.faces_count()):
+        row = []
+        for j in range(0, me.face_size(i)):
+            row.append(me.face_point(i, j))
+        faces.append(tuple(row))
+
+    mesh = bpy.data.meshes.new(mesh_name)
+    mesh.from_pydata(vertices2, [], faces)
+
+    values = [True] * len(mesh.polygons)
+    mesh.polygons.foreach_set('use_smooth', values)
+
+    uvtex = mesh.uv_layers.new()
+    uvmap = uvtex.data
+    for i in range(me.uvs_count()):
+        uvmap[i].uv = me.uv(i)
+
+    mesh.update()
+    return mesh
+
+
+def mesh_arrays(mesh):
+    verts = np.empty((len(mesh.vertices), 3), dtype=np.float32)
+    mesh.vertices.foreach_get('co', verts.ravel())
+    loops = np.empty(len(mesh.loops), dtype=np.int32)
+    mesh.loops.foreach_get('vertex_index', loops)
+    totals = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get('loop_total', totals)
+    edges = np.empty((len(mesh.edges), 2), dtype=np.int32)
+    mesh.edges.foreach_get('vertices', edges.ravel())
+    uvs = np.empty((len(mesh.loops), 2), dtype=np.float32)
+    mesh.uv_layers[0].data.foreach_get('uv', uvs.ravel())
+    return verts, loops, totals, edges, uvs